@@ -1,15 +1,249 @@
+import logging
+import os
 import re
+import socket
 import subprocess
+import threading
+import time
 from shlex import quote
 
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+
+
+def get_devices():
+    """
+    serials of the devices and emulators `adb devices` lists as ready
+    """
+    r = subprocess.check_output(["adb", "devices"])
+    if not isinstance(r, str):
+        r = r.decode()
+    serials = []
+    for line in r.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == "device":
+            serials.append(parts[0])
+    return serials
+
+
+class AdbError(Exception):
+    pass
+
+
+class AdbConnection:
+    """
+    one socket to the adb server, requests are hex length prefixed and
+    answered with OKAY or FAIL<hex length><message>
+    """
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+
+    def send_request(self, request):
+        payload = request.encode("utf-8")
+        self.sock.sendall(b"%04x" % len(payload) + payload)
+        self.read_status()
+
+    def read_status(self):
+        status = self.recv_exactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(self.recv_exactly(4), 16)
+            raise AdbError(self.recv_exactly(length).decode("utf-8", "replace"))
+        raise AdbError("unexpected adb server response: %r" % status)
+
+    def recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise AdbError("adb server closed the connection")
+            data += chunk
+        return data
+
+    def iter_chunks(self, size=65536):
+        while True:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read_all(self):
+        return b"".join(self.iter_chunks())
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AdbStream:
+    """
+    output lines of a long running command, read from a shell: service
+    connection or from an adb process. close() may be called from another
+    thread to end the iteration.
+    """
+    def __init__(self, conn=None, process=None):
+        self.conn = conn
+        self.process = process
+
+    def __iter__(self):
+        if self.process is not None:
+            try:
+                for line in self.process.stdout:
+                    yield line.decode("utf-8", "replace").rstrip("\r\n")
+            finally:
+                self.close()
+                self.process.wait()
+            return
+        rest = b""
+        try:
+            for chunk in self.conn.iter_chunks():
+                lines = (rest + chunk).split(b"\n")
+                rest = lines.pop()
+                for line in lines:
+                    yield line.decode("utf-8", "replace").rstrip("\r")
+        except OSError:
+            # closed while blocked in recv
+            pass
+        finally:
+            self.close()
+        if rest:
+            yield rest.decode("utf-8", "replace").rstrip("\r")
+
+    def close(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+            return
+        try:
+            self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class AdbClient:
+    """
+    talks to the adb server socket directly instead of forking adb per command.
+    a service such as shell: consumes its connection, so a small pool of
+    connections already switched to the device transport is kept warm and
+    refilled in the background.
+    """
+    def __init__(self, serial, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, pool_size=2, timeout=None):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pool = []
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def connect(self):
+        return AdbConnection(self.host, self.port, self.timeout)
+
+    def open_transport(self):
+        conn = self.connect()
+        try:
+            if self.serial:
+                conn.send_request("host:transport:%s" % self.serial)
+            else:
+                conn.send_request("host:transport-any")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.pool) >= self.pool_size:
+                        break
+                conn = self.open_transport()
+                with self.lock:
+                    self.pool.append(conn)
+        except (OSError, AdbError):
+            pass
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def get_transport(self):
+        with self.lock:
+            conn = self.pool.pop() if self.pool else None
+            start_refill = not self.refilling
+            self.refilling = True
+        if start_refill:
+            threading.Thread(target=self.refill, daemon=True).start()
+        if conn is None:
+            conn = self.open_transport()
+        return conn
+
+    def open_service(self, service):
+        """
+        open a device service, a pooled connection may have gone stale (device
+        reconnected, server restarted) so a failure is retried on a fresh one
+        """
+        conn = self.get_transport()
+        try:
+            conn.send_request(service)
+            return conn
+        except (OSError, AdbError):
+            conn.close()
+        conn = self.open_transport()
+        try:
+            conn.send_request(service)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def shell(self, cmd):
+        conn = self.open_service("shell:%s" % cmd)
+        try:
+            r = conn.read_all()
+        finally:
+            conn.close()
+        return r.decode("utf-8", "replace").strip()
+
+    def shell_stream(self, cmd):
+        """
+        the output lines of a shell command as they arrive, see AdbStream
+        """
+        return AdbStream(conn=self.open_service("shell:%s" % cmd))
+
+    def host_request(self, request):
+        conn = self.connect()
+        try:
+            conn.send_request(request)
+            length = int(conn.recv_exactly(4), 16)
+            return conn.recv_exactly(length).decode("utf-8", "replace")
+        finally:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, []
+        for conn in pool:
+            conn.close()
+
 
 class ADB:
-    def __init__(self, device=None):
+    def __init__(self, device=None, use_socket=True):
         if device is None:
             from device import DeviceUI
             device = DeviceUI()
+        self.logger = logging.getLogger(self.__class__.__name__)
         self.device = device
         self.cmd_prefix = ['adb', '-s', device.serial]
+        # shell commands go through the adb server socket, run_cmd stays on the adb binary
+        self.client = AdbClient(device.serial) if use_socket else None
+        # package -> (installed, check time)
+        self.installed_cache = {}
+        self.installed_cache_age = 2
 
     def run_cmd(self, args):
         if isinstance(args, str):
@@ -25,9 +259,41 @@ class ADB:
     def shell(self, args):
         if isinstance(args, str):
             args = args.split()
-        shell_args = ['shell'] + [quote(arg) for arg in args ]
+        args = [quote(arg) for arg in args]
+        if self.client is not None:
+            try:
+                return self.client.shell(" ".join(args))
+            except (OSError, AdbError) as e:
+                self.logger.warning("adb server socket failed, falling back to adb binary: %s" % e)
+        shell_args = ['shell'] + args
         return self.run_cmd(shell_args)
 
+    def shell_raw(self, cmd):
+        """
+        run a shell command line as is, pipes and redirections included
+        """
+        if self.client is not None:
+            try:
+                return self.client.shell(cmd)
+            except (OSError, AdbError) as e:
+                self.logger.warning("adb server socket failed, falling back to adb binary: %s" % e)
+        return self.run_cmd(["shell", cmd])
+
+    def shell_stream(self, cmd):
+        """
+        stream the output lines of a raw (unquoted) shell command, returns an AdbStream
+        """
+        if self.client is not None:
+            try:
+                return self.client.shell_stream(cmd)
+            except (OSError, AdbError) as e:
+                self.logger.warning("adb server socket failed, falling back to adb binary: %s" % e)
+        return self.stream_cmd(["shell", cmd])
+
+    def stream_cmd(self, args):
+        return AdbStream(process=subprocess.Popen(self.cmd_prefix + args, stdout=subprocess.PIPE,
+                                                  stderr=subprocess.DEVNULL))
+
     def get_installed_apps(self):
         app_lines = self.shell("pm list packages -f").splitlines()
         app_line_re = re.compile("package:(?P<apk_path>.+)=(?P<package>[^=]+)")
@@ -36,4 +302,29 @@ class ADB:
             m = app_line_re.match(app_line)
             if m:
                 package_to_path[m.group('package')] = m.group('apk_path')
-        return package_to_path
\ No newline at end of file
+        return package_to_path
+
+    def get_package_path(self, package_name):
+        r = self.shell_raw("pm path %s" % quote(package_name))
+        for line in r.splitlines():
+            if line.startswith("package:"):
+                return line[len("package:"):]
+        return None
+
+    def is_installed(self, package_name):
+        cached = self.installed_cache.get(package_name)
+        if cached is not None and time.time() - cached[1] < self.installed_cache_age:
+            return cached[0]
+        try:
+            installed = self.get_package_path(package_name) is not None
+        except subprocess.CalledProcessError:
+            # pm path exits non-zero for unknown packages on some versions
+            installed = False
+        self.installed_cache[package_name] = (installed, time.time())
+        return installed
+
+    def invalidate_installed(self, package_name=None):
+        if package_name is None:
+            self.installed_cache.clear()
+        else:
+            self.installed_cache.pop(package_name, None)
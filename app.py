@@ -1,22 +1,99 @@
+import hashlib
+import json
+import os
+
+APK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "crashdect", "apk")
+
+
+def get_apk_hash(apk_path):
+    sha256 = hashlib.sha256()
+    with open(apk_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_activity_class(component):
+    """
+    pkg/.Main and pkg/pkg.Main both become pkg.Main, the form App.activities uses
+    """
+    if not component or "/" not in component:
+        return component
+    package_name, activity = component.split("/", 1)
+    return package_name + activity if activity.startswith(".") else activity
+
+
 class App:
-    def __init__(self, apk_path):
+    def __init__(self, apk_path, cache_dir=APK_CACHE_DIR):
         """
        create an App instance
        :param app_path: local file path of app
+       :param cache_dir: where parsed manifest metadata is cached, keyed by apk content hash
        :return:
        """
         assert apk_path is not None
         self.apk_path = apk_path
-        from androguard.core.bytecodes.apk import APK
-        self.apk = APK(self.apk_path)
-        self.package_name = self.apk.get_package()
-        self.main_activity = self.apk.get_main_activity()
-        self.permissions = self.apk.get_permissions()
-        self.activities = self.apk.get_activities()
+        self.cache_dir = cache_dir
+        self._apk = None
+        self.apk_hash = get_apk_hash(apk_path)
+
+        metadata = self.load_metadata()
+        if metadata is None:
+            metadata = {
+                "package_name":     self.apk.get_package(),
+                "main_activity":    self.apk.get_main_activity(),
+                "permissions":      list(self.apk.get_permissions()),
+                "activities":       list(self.apk.get_activities()),
+            }
+            self.save_metadata(metadata)
+        self.package_name = metadata["package_name"]
+        self.main_activity = metadata["main_activity"]
+        self.permissions = metadata["permissions"]
+        self.activities = metadata["activities"]
+
+    @property
+    def apk(self):
+        # androguard is slow to import and to parse with, only done on a cache miss
+        if self._apk is None:
+            from androguard.core.bytecodes.apk import APK
+            self._apk = APK(self.apk_path)
+        return self._apk
+
+    @property
+    def metadata_path(self):
+        return os.path.join(self.cache_dir, "%s.json" % self.apk_hash)
+
+    def load_metadata(self):
+        if self.cache_dir is None or not os.path.exists(self.metadata_path):
+            return None
+        try:
+            with open(self.metadata_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_metadata(self, metadata):
+        if self.cache_dir is None:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = "%s.%d.tmp" % (self.metadata_path, os.getpid())
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(temp_path, self.metadata_path)
+        except OSError:
+            pass
+
+    def __getstate__(self):
+        # the androguard APK object is not needed by the workers, only the metadata is sent
+        state = self.__dict__.copy()
+        state["_apk"] = None
+        return state
 
 
 if __name__ == '__main__':
     app_path = './app/amaze.apk'
     app = App(app_path)
     print(app.main_activity)
-    print(app.permissions)
\ No newline at end of file
+    print(app.permissions)
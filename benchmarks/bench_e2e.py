@@ -0,0 +1,115 @@
+"""
+end-to-end events/sec of the exploration loop against a simulated device
+
+    python -m benchmarks.bench_e2e --duration 10
+    python -m benchmarks.bench_e2e --recording rec.json --dump_latency 0.3 --tap_latency 0.05
+    python -m benchmarks.bench_e2e --from_run output/<serial> --package com.example.app
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+from threading import Timer
+
+from benchmarks.synthetic import generate_recording
+from controller import Controller, SETTLE_FIXED, SETTLE_ADAPTIVE
+from model import MODEL_RANDOM, MODEL_COVERAGE
+from profiler import PROFILER
+from screenshot import ScreenshotPolicy, SCREENSHOT_NEVER, SCREENSHOT_POLICIES
+from sim_device import SimDevice, SimRecording
+
+
+def run(recording, duration, output_path, latency, model_name=MODEL_RANDOM, throttle=0, settle_mode=SETTLE_FIXED,
+        screenshot_policy=SCREENSHOT_NEVER, batch_size=1, trace=False, launch_activities=False, seed=0):
+    device = SimDevice(recording, output_path=output_path, latency=latency, seed=seed)
+    app = recording.get_app()
+    controller = Controller(
+        device            = device,
+        app               = app,
+        model_name        = model_name,
+        throttle          = throttle,
+        trace             = trace,
+        settle_mode       = settle_mode,
+        screenshot_policy = ScreenshotPolicy(screenshot_policy),
+        batch_size        = batch_size,
+        launch_activities = launch_activities
+    )
+    device.set_up()
+    device.connect()
+    device.install_app(app)
+    device.logcat(app.package_name, controller.on_crash)
+
+    timer = Timer(duration, lambda: setattr(controller, "enabled", False))
+    timer.start()
+    controller.start()
+    device.stop()
+
+    metrics = PROFILER.to_dict()
+    summary = controller.get_summary()
+    return {
+        "events":               summary["events"],
+        "events_per_second":    metrics["events_per_second"],
+        "sent_events":          device.sent_events,
+        "states":               summary["states"],
+        "activity_coverage":    summary["activity_coverage"],
+        "crashes":              len(summary["crashes"]),
+        "stages":               {name: {"count": stage["count"], "mean": stage["mean"], "p99": stage["p99"]}
+                                 for name, stage in metrics["stages"].items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the exploration loop against a simulated device.")
+    parser.add_argument("--recording", action="store", dest="recording", help="SimRecording json file")
+    parser.add_argument("--from_run", action="store", dest="from_run", help="output directory of a real run")
+    parser.add_argument("--package", action="store", dest="package", default="com.example.app",
+                        help="package name of the app in --from_run")
+    parser.add_argument("--screens", action="store", dest="screens", type=int, default=20,
+                        help="screens of the synthetic recording")
+    parser.add_argument("--nodes", action="store", dest="nodes", type=int, default=300,
+                        help="nodes per synthetic screen")
+    parser.add_argument("--model_name", action="store", dest="model_name", default=MODEL_RANDOM,
+                        choices=[MODEL_RANDOM, MODEL_COVERAGE])
+    parser.add_argument("--duration", action="store", dest="duration", type=float, default=10)
+    parser.add_argument("--throttle", action="store", dest="throttle", type=int, default=0)
+    parser.add_argument("--settle_mode", action="store", dest="settle_mode", default=SETTLE_FIXED,
+                        choices=[SETTLE_FIXED, SETTLE_ADAPTIVE])
+    parser.add_argument("--screenshot_policy", action="store", dest="screenshot_policy", default=SCREENSHOT_NEVER,
+                        choices=SCREENSHOT_POLICIES)
+    parser.add_argument("--batch_size", action="store", dest="batch_size", type=int, default=1)
+    parser.add_argument("--trace", action="store_true", dest="trace")
+    parser.add_argument("--launch_activities", action="store_true", dest="launch_activities")
+    parser.add_argument("--dump_latency", action="store", dest="dump_latency", type=float, default=0,
+                        help="seconds added to every hierarchy dump")
+    parser.add_argument("--tap_latency", action="store", dest="tap_latency", type=float, default=0,
+                        help="seconds added to every click, swipe and key press")
+    parser.add_argument("--shell_latency", action="store", dest="shell_latency", type=float, default=0,
+                        help="seconds added to every shell call")
+    parser.add_argument("-o", "--output", action="store", dest="output_path",
+                        help="keep the run's output here instead of a temporary directory")
+    opts = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if opts.recording:
+        recording = SimRecording.load(opts.recording)
+    elif opts.from_run:
+        recording = SimRecording.from_run(opts.from_run, opts.package)
+    else:
+        recording = generate_recording(opts.screens, opts.nodes)
+    latency = {"dump_hierarchy":    opts.dump_latency,
+               "click":             opts.tap_latency,
+               "swipe":             opts.tap_latency,
+               "press":             opts.tap_latency,
+               "shell":             opts.shell_latency}
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        result = run(recording, opts.duration, opts.output_path or os.path.join(tmp_path, "sim-0"), latency,
+                     model_name=opts.model_name, throttle=opts.throttle, settle_mode=opts.settle_mode,
+                     screenshot_policy=opts.screenshot_policy, batch_size=opts.batch_size, trace=opts.trace,
+                     launch_activities=opts.launch_activities)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+offline micro-benchmarks of the per-event parsing and selection hot path
+
+    python -m benchmarks.bench_hotpath             # run and compare with baseline.json
+    python -m benchmarks.bench_hotpath --save      # run and store the results as the new baseline
+    python -m benchmarks.bench_hotpath --check     # exit 1 when a case regressed beyond --tolerance
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import generate_hierarchy
+from event import Event
+from model import RandomModel
+from utils.tree.node import Node
+from utils.tree.trans_xml import xml_to_tree, get_root_tree, parse_hierarchy
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_XML_PATH = os.path.join(BENCH_DIR, "..", "utils", "tree", "test.xml")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+SYNTHETIC_SIZES = [100, 1000, 5000, 20000]
+SYNTHETIC_PACKAGE = "com.example.app"
+TEST_XML_PACKAGE = "com.ss.android.ugc.aweme"
+
+
+class BenchApp:
+    """
+    the few App attributes RandomModel reads, without parsing an apk
+    """
+    def __init__(self, package_name):
+        self.package_name = package_name
+        self.main_activity = None
+        self.activities = []
+
+
+def measure(func, min_time=0.2, repeat=7):
+    """
+    best and median seconds per call over repeat rounds, with gc paused so a
+    collection does not land in one round only
+    """
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return min(timings), statistics.median(timings)
+
+
+def measure_peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def calibration_workload():
+    table = {}
+    for i in range(2000):
+        table["key%d" % i] = [i, str(i)]
+    return sum(len(value[1]) for value in table.values())
+
+
+def calibrate():
+    """
+    seconds for a fixed pure python workload, results are compared relative to
+    it so a slower or busier machine does not read as a regression
+    """
+    return measure(calibration_workload)[0]
+
+
+def get_cases():
+    with open(TEST_XML_PATH, encoding="utf-8") as f:
+        cases = [("test.xml", f.read(), TEST_XML_PACKAGE)]
+    for size in SYNTHETIC_SIZES:
+        cases.append(("synthetic_%d" % size, generate_hierarchy(size, package=SYNTHETIC_PACKAGE),
+                      SYNTHETIC_PACKAGE))
+    return cases
+
+
+def get_benchmarks(xml, package_name):
+    trees, action_index = parse_hierarchy(xml)
+    tree = [temp_tree for temp_tree in trees if temp_tree.package == package_name][-1]
+    elements = list(ET.fromstring(xml))
+    model = RandomModel(None, BenchApp(package_name))
+    widgets = action_index.get_widgets(package_name)
+    nodes = Node.get_nodes_from_tree(tree)
+    event = Event().from_action_type(nodes[0], Node.get_actions_from_node(nodes[0])[0])
+    random.seed(0)
+    return {
+        "xml_to_tree":          lambda: xml_to_tree(xml),
+        "get_root_tree":        lambda: [get_root_tree(element) for element in elements],
+        "get_nodes_from_tree":  lambda: Node.get_nodes_from_tree(tree),
+        "select_node":          lambda: model.select_node(widgets),
+        "select_action":        lambda: model.select_action(widgets[0][1]),
+        "event_dict":           lambda: json.dumps(event.event_dict),
+    }
+
+
+def run():
+    """
+    returns (results, calibration), the calibration is re-measured between
+    cases and the best one is kept
+    """
+    results = {}
+    calibrations = []
+    for case_name, xml, package_name in get_cases():
+        calibrations.append(calibrate())
+        for bench_name, func in get_benchmarks(xml, package_name).items():
+            best, median = measure(func)
+            results["%s/%s" % (bench_name, case_name)] = {
+                "best":         best,
+                "median":       median,
+                "peak_memory":  measure_peak_memory(func),
+            }
+    calibrations.append(calibrate())
+    return results, min(calibrations)
+
+
+def compare(results, calibration, baseline, baseline_calibration, tolerance):
+    regressions = []
+    scale = calibration / baseline_calibration if baseline_calibration else 1
+    print("%-40s %12s %12s %12s %8s" % ("benchmark", "best(us)", "median(us)", "peak(KiB)", "vs base"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        ratio = result["best"] / (base["best"] * scale) if base and base["best"] else None
+        flag = ""
+        if ratio is not None and ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print("%-40s %12.1f %12.1f %12.1f %8s%s" % (name, result["best"] * 1e6, result["median"] * 1e6,
+                                                    result["peak_memory"] / 1024,
+                                                    "%.2fx" % ratio if ratio is not None else "-", flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing and selection hot path.")
+    parser.add_argument("--baseline", action="store", dest="baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", dest="save", help="store the results as the baseline")
+    parser.add_argument("--check", action="store_true", dest="check", help="exit 1 on a regression")
+    parser.add_argument("--tolerance", action="store", dest="tolerance", type=float, default=0.5,
+                        help="allowed slowdown of the best time against the baseline (after calibration), "
+                             "default 0.5")
+    opts = parser.parse_args()
+
+    results, calibration = run()
+    baseline = {}
+    if os.path.exists(opts.baseline):
+        with open(opts.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print("calibration: %.1fus (baseline %.1fus)" % (calibration * 1e6, baseline.get("calibration", 0) * 1e6))
+    regressions = compare(results, calibration, baseline.get("results", {}), baseline.get("calibration"),
+                          opts.tolerance)
+
+    if opts.save:
+        with open(opts.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "calibration": calibration, "results": results}, f,
+                      indent=2, sort_keys=True)
+        print("baseline written to", opts.baseline)
+    if regressions:
+        print("%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+        if opts.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
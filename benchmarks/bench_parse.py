@@ -0,0 +1,142 @@
+"""
+compare the single pass hierarchy parser with the previous ElementTree based one
+
+    python -m benchmarks.bench_parse
+"""
+import collections
+import os
+import re
+import timeit
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import generate_hierarchy
+from utils.tree.compact import xml_to_compact_tree
+from utils.tree.node import Node, Point
+from utils.tree.trans_xml import xml_to_tree
+
+TEST_XML_PATH = os.path.join(os.path.dirname(__file__), "..", "utils", "tree", "test.xml")
+
+
+# the baseline utils/tree/trans_xml.py, copied verbatim with the functions prefixed by legacy_
+def legacy_element_to_node(attr):
+    node = Node()
+    node.index              = int(attr['index'])
+    node.text               = attr['text']
+    node.resource_id        = attr['resource-id']
+    node.class_             = attr['class']
+    node.package            = attr['package']
+    node.content_desc       = attr['content-desc']
+    node.checkable          = False if attr['checkable'] == "false" else True
+    node.checked            = False if attr['checked'] == "false" else True
+    node.clickable          = False if attr['clickable'] == "false" else True
+    node.enabled            = False if attr['enabled'] == "false" else True
+    node.focusable          = False if attr['focusable'] == "false" else True
+    node.focused            = False if attr['focused'] == "false" else True
+    node.scrollable         = False if attr['scrollable'] == "false" else True
+    node.long_clickable     = False if attr['long-clickable'] == "false" else True
+    node.password           = False if attr['password'] == "false" else True
+    node.selected           = False if attr['selected'] == "false" else True
+    node.visible_to_user    = False if attr['visible-to-user'] == "false" else True
+    bounds                  = attr['bounds']
+
+    source_bounds = re.compile('\[([^ ]+),([^ ]+)\]\[([^ ]+),([^ ]+)\]')
+    dist_activities = source_bounds.search(bounds)
+    if dist_activities:
+        node.bounds = Point(dist_activities.group(1),
+                            dist_activities.group(2),
+                            dist_activities.group(3),
+                            dist_activities.group(4))
+    return node
+
+
+def legacy_hash_tag_attrib(attrib):
+    val = attrib['index'] + attrib['text'] + attrib['resource-id'] + attrib['class'] + attrib['package'] + attrib['content-desc'] + attrib['bounds']
+    return hash(val)
+
+
+def legacy_get_root_tree(element):
+    element_node_table = {}
+    q = collections.deque()
+    q.append(element)
+
+    root = legacy_element_to_node(element.attrib)
+    hash_attrib = legacy_hash_tag_attrib(element.attrib)
+    element_node_table[hash_attrib] = root
+
+    while q:
+        el = q.pop()
+
+        attrib = el.attrib
+        hash_attrib = legacy_hash_tag_attrib(attrib)
+        if hash_attrib not in element_node_table.keys():
+            element_node_table[hash_attrib] = legacy_element_to_node(attrib)
+        temp_root_node = element_node_table[hash_attrib]
+
+        for child in el:
+            q.append(child)
+
+            child_node = legacy_element_to_node(child.attrib)
+            temp_root_node.children.append(child_node)
+            child_node.parent = temp_root_node
+
+            hash_attrib = legacy_hash_tag_attrib(child.attrib)
+            element_node_table[hash_attrib] = child_node
+
+    return root
+
+
+def legacy_xml_to_tree(xml):
+    elements = []
+
+    root_et = ET.fromstring(xml)
+    q = collections.deque()
+    q.append(root_et)
+
+    # 过滤 hierarchy, 得到n个element
+    el = q.pop()
+    assert el.tag == "hierarchy"
+    for child in el:
+        elements.append(child)
+
+    # 遍历n个element，获取对应n个树
+    roots = []
+    for el in elements:
+        root = legacy_get_root_tree(el)
+        roots.append(root)
+
+    return roots
+
+
+def count_nodes(trees):
+    count = 0
+    stack = list(trees)
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+
+def bench(func, xml, repeat=5):
+    number = max(1, int(0.2 / max(timeit.timeit(lambda: func(xml), number=1), 1e-6)))
+    return min(timeit.repeat(lambda: func(xml), number=number, repeat=repeat)) / number
+
+
+def main():
+    with open(TEST_XML_PATH, encoding="utf-8") as f:
+        cases = [("test.xml", f.read())]
+    for node_num in (100, 1000, 5000, 20000):
+        cases.append(("synthetic %d" % node_num, generate_hierarchy(node_num)))
+
+    print("%-18s %8s %12s %12s %8s %12s" % ("hierarchy", "nodes", "legacy(ms)", "single(ms)", "speedup",
+                                            "compact(ms)"))
+    for name, xml in cases:
+        legacy = bench(legacy_xml_to_tree, xml)
+        single = bench(xml_to_tree, xml)
+        compact = bench(xml_to_compact_tree, xml)
+        print("%-18s %8d %12.2f %12.2f %7.1fx %12.2f" % (name, count_nodes(xml_to_tree(xml)), legacy * 1000,
+                                                         single * 1000, legacy / single, compact * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import random
+
+NODE_TEMPLATE = '<node index="%d" text="%s" resource-id="%s" class="%s" package="%s" content-desc="" ' \
+                'checkable="false" checked="false" clickable="%s" enabled="true" focusable="%s" focused="false" ' \
+                'scrollable="%s" long-clickable="%s" password="false" selected="false" visible-to-user="true" ' \
+                'bounds="[%d,%d][%d,%d]"'
+
+CLASSES = ["android.widget.FrameLayout", "android.widget.LinearLayout", "android.widget.TextView",
+           "android.widget.ImageView", "android.widget.Button", "androidx.recyclerview.widget.RecyclerView"]
+
+
+def generate_hierarchy(node_num, package="com.example.app", fanout=8, seed=0):
+    """
+    build a uiautomator2 style hierarchy dump with node_num nodes, shaped like
+    a list screen: nested layouts with fanout children each
+    """
+    rnd = random.Random(seed)
+    lines = ["<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>", '<hierarchy rotation="0">']
+    count = [0]
+
+    def add_node(depth, index, left, top, right, bottom):
+        count[0] += 1
+        class_ = rnd.choice(CLASSES)
+        clickable = "true" if rnd.random() < 0.3 else "false"
+        long_clickable = "true" if rnd.random() < 0.05 else "false"
+        scrollable = "true" if class_.endswith("RecyclerView") else "false"
+        attrs = NODE_TEMPLATE % (index, "item %d" % count[0], "%s:id/view_%d" % (package, count[0] % 50),
+                                 class_, package, clickable, clickable, scrollable, long_clickable,
+                                 left, top, right, bottom)
+        children = []
+        child_num = min(fanout, node_num - count[0])
+        if depth < 12 and child_num > 0:
+            height = max((bottom - top) // child_num, 1)
+            for i in range(child_num):
+                if count[0] >= node_num:
+                    break
+                children.append(add_node(depth + 1, i, left, top + i * height, right, top + (i + 1) * height))
+        if not children:
+            return "%s%s />" % ("  " * depth, attrs)
+        return "%s%s>\n%s\n%s</node>" % ("  " * depth, attrs, "\n".join(children), "  " * depth)
+
+    while count[0] < node_num:
+        lines.append(add_node(1, 0, 0, 0, 1080, 2340))
+    lines.append("</hierarchy>")
+    return "\n".join(lines)
+
+
+def generate_recording(screen_num=20, node_num=300, package="com.example.app", crash_rate=0.01, seed=0):
+    """
+    a SimRecording of screen_num synthetic screens over four activities, every
+    resource id of a screen leads to a random screen or, now and then, a crash
+    """
+    from sim_device import SimRecording, SimState
+
+    rnd = random.Random(seed)
+    states = {}
+    transitions = []
+    for i in range(screen_num):
+        name = "screen_%d" % i
+        states[name] = SimState(name, generate_hierarchy(node_num, package, seed=seed + i),
+                                "%s/.Activity%d" % (package, i % 4))
+        for view in range(50):
+            transition = {"from": name, "action": "click", "resource_id": "%s:id/view_%d" % (package, view)}
+            if rnd.random() < crash_rate:
+                transition["crash"] = "java.lang.IllegalStateException: synthetic crash on %s" % name
+            else:
+                transition["to"] = "screen_%d" % rnd.randrange(screen_num)
+            transitions.append(transition)
+    return SimRecording(package, states, transitions, "screen_0", main_activity="%s.Activity0" % package)
@@ -1,48 +1,248 @@
+import json
 import logging
+import os
+import threading
 import time
 
 from event import EventLog
-from model import MODEL_RANDOM, RandomModel
+from event_writer import EventLogWriter
+from event_trace import TraceWriter
+from launcher import ActivityLauncher
+from state_graph import StateGraph
+from model import MODEL_RANDOM, MODEL_COVERAGE, RandomModel, CoverageModel
+from profiler import PROFILER
+from screenshot import ScreenshotCapturer
+
+SETTLE_FIXED = "fixed"
+SETTLE_ADAPTIVE = "adaptive"
 
 
 class Controller:
-    def __init__(self, device, app, model_name, throttle, script_path=None):
+    def __init__(self, device, app, model_name, throttle, script_path=None, state_max_age=5, trace=False,
+                 settle_mode=SETTLE_FIXED, settle_interval=0.05, screenshot_policy=None, screenshot_scale=1.0,
+                 screenshot_format="png", batch_size=1, metrics_interval=30, launch_activities=False):
         self.logger = logging.getLogger('InputEventManager')
         self.logger.setLevel(level=logging.INFO)
         self.enabled = True
+        self.stopped = False
 
         self.device = device
         self.app = app
         self.model_name = model_name
         self.throttle = throttle
+        # fixed sleeps throttle ms after each event, adaptive waits until the ui is idle (at most throttle ms)
+        self.settle_mode = settle_mode
+        self.settle_interval = settle_interval
+        # > 1 plans that many events from one snapshot and sends them in a single shell call
+        self.batch_size = batch_size
+        # start every activity of the manifest directly before the model explores the ui
+        self.launch_activities = launch_activities
         self.model = None
         self.event_log = None
+        self.event_count = 0
+        self.crashes = []
+        # last captured state, reused as the from_state of the next event
+        self.last_state = None
+        # bumped by invalidate_state, a state captured across a bump is not cached
+        self.state_generation = 0
+        self.state_lock = threading.Lock()
+        self.state_max_age = state_max_age
+        self.state_graph = StateGraph()
+        self.screenshots = ScreenshotCapturer(device, policy=screenshot_policy, scale=screenshot_scale,
+                                              image_format=screenshot_format)
+        # trace=True stores the run as one append-only trace file instead of per-event files
+        self.writer = EventLogWriter(store=TraceWriter(device.output_path) if trace else None)
 
+        PROFILER.configure(device.output_path, metrics_interval)
         self.model = self.get_model(device, app)
 
     def get_model(self, device, app):
         if self.model_name == MODEL_RANDOM:
             model = RandomModel(self.device, self.app)
+        elif self.model_name == MODEL_COVERAGE:
+            model = CoverageModel(self.device, self.app)
         else:
             self.logger.warning("No valid input policy specified. Using policy \"none\".")
             model = None
 
         return model
 
-    def add_event(self, event):
+    def add_event(self, event, state=None):
         if event is None:
             return
-        self.event_log = EventLog(self.device, self.app, event)
-        self.event_log.start()
-        time.sleep(self.throttle / 1000)
-        self.event_log.stop()
+        if state is None:
+            state = self.get_current_state()
+        self.event_count += 1
+        self.event_log = EventLog(self.device, self.app, event, writer=self.writer)
+        generation = self.state_generation
+        if self.device.crash_monitor is not None:
+            self.device.crash_monitor.event_tag = self.event_log.tag
+        self.event_log.start(from_state=state)
+        self.event_log.settle_time = self.settle()
+        to_state = self.device.get_current_state()
+        if self.event_log.from_state is not None and to_state is not None:
+            is_new_state = self.state_graph.add_transition(self.event_log.from_state, event,
+                                                           to_state, self.event_log.tag)
+            # before the log goes to the writer, so it waits for the image
+            self.screenshots.on_state(to_state, is_new_state)
+        self.event_log.finish(to_state)
+        PROFILER.count_events()
+        PROFILER.maybe_export()
+        self.cache_state(to_state, generation)
+
+    def add_events(self, events, state=None):
+        """
+        send a batch of events planned from the same state as one shell script,
+        the state is captured once at the end. every event is still logged on
+        its own, with the batch it belongs to, so a crash can be bisected. the
+        state graph gets one transition for the whole batch.
+        """
+        events = [event for event in events if event is not None]
+        if len(events) <= 1:
+            for event in events:
+                self.add_event(event, state)
+            return
+        if state is None:
+            state = self.get_current_state()
+        self.event_count += len(events)
+        event_logs = [EventLog(self.device, self.app, event, writer=self.writer) for event in events]
+        batch_id = event_logs[0].tag
+        for index, event_log in enumerate(event_logs):
+            event_log.from_state = state
+            event_log.batch = {"id": batch_id, "index": index, "size": len(event_logs)}
+        generation = self.state_generation
+        if self.device.crash_monitor is not None:
+            self.device.crash_monitor.event_tag = batch_id
+
+        script = "; ".join(event.get_input_cmd() for event in events)
+        self.device.foreground.invalidate()
+        with PROFILER.stage("send_batch"):
+            self.device.adb.shell_raw(script)
+        settle_time = self.settle()
+        to_state = self.device.get_current_state()
+        if state is not None and to_state is not None:
+            is_new_state = self.state_graph.add_transition(state, events, to_state, batch_id)
+            self.screenshots.on_state(to_state, is_new_state)
+        for event_log in event_logs:
+            event_log.settle_time = settle_time
+            event_log.finish(to_state)
+        PROFILER.count_events(len(event_logs))
+        PROFILER.maybe_export()
+
+        self.event_log = event_logs[-1]
+        self.cache_state(to_state, generation)
+
+    def settle(self):
+        """
+        wait after sending events, returns the settle time
+        """
+        settle_start = time.time()
+        with PROFILER.stage("settle"):
+            if self.settle_mode == SETTLE_ADAPTIVE:
+                self.wait_for_idle()
+            else:
+                time.sleep(self.throttle / 1000)
+        return time.time() - settle_start
+
+    def wait_for_idle(self):
+        """
+        probe the device (see DeviceUI.probe_idle) until two consecutive probes
+        are identical, no probe is started past the throttle
+        """
+        deadline = time.time() + self.throttle / 1000
+        last_probe = None
+        while time.time() + self.settle_interval < deadline:
+            time.sleep(self.settle_interval)
+            probe = self.device.probe_idle(self.app.package_name)
+            if probe is not None and probe == last_probe:
+                return
+            last_probe = probe
+        time.sleep(max(0, deadline - time.time()))
+
+    def get_current_state(self):
+        state = self.last_state
+        if state is None or state.is_stale(self.state_max_age):
+            generation = self.state_generation
+            state = self.device.get_current_state()
+            self.cache_state(state, generation)
+            if state is not None:
+                self.screenshots.on_state(state, state.signature not in self.state_graph)
+        return state
+
+    def cache_state(self, state, generation):
+        """
+        keep state as last_state unless a crash (invalidate_state) came in
+        since its capture began, that screen may show an app that is gone
+        """
+        with self.state_lock:
+            self.last_state = state if generation == self.state_generation else None
+
+    def invalidate_state(self):
+        with self.state_lock:
+            self.state_generation += 1
+            self.last_state = None
+
+    def on_crash(self, crash):
+        """
+        called by the crash monitor as soon as a crash is parsed, the state is
+        dropped so the next step sees the app is gone and relaunches it
+        """
+        self.crashes.append(crash)
+        self.invalidate_state()
+        self.device.foreground.invalidate()
+        crashes_output_path = os.path.join(self.device.output_path, "crashes")
+        if not os.path.exists(crashes_output_path):
+            os.makedirs(crashes_output_path, exist_ok=True)
+        crash_file_path = "%s/crash_%s_%d.json" % (crashes_output_path, crash.tag, len(self.crashes))
+        screenshot_path = os.path.splitext(crash_file_path)[0] + "." + self.screenshots.extension
+        future = self.screenshots.on_crash(screenshot_path)
+        if future is not None:
+            # only point at the image once it is on disk
+            crash.screenshot_path = future.result()
+        with open(crash_file_path, "w", encoding="utf-8") as f:
+            json.dump(crash.crash_dict, f, indent=2)
 
     def start(self):
+        if self.launch_activities:
+            self.logger.info("launching activities directly")
+            ActivityLauncher(self).run()
         self.logger.info("start sending events, policy is %s" % self.model_name)
-        self.model.start(self)
-        self.stop()
+        PROFILER.start()
+        try:
+            self.model.start(self)
+        finally:
+            self.stop()
         self.logger.info("Finish sending events")
 
     def stop(self):
-        print("Activity Coverage: ", len(self.model.activities) / len(self.model.all_activities))
+        """
+        flush and save what the run produced, called by start once the loop is
+        over. other threads end the run by setting enabled to False instead
+        """
         self.enabled = False
+        if self.stopped:
+            return
+        self.stopped = True
+        self.screenshots.close()
+        self.writer.close()
+        self.logger.info("event log writer: %s" % self.writer.stats)
+        self.state_graph.save(self.device.output_path)
+        PROFILER.export()
+        print("Distinct States: ", len(self.state_graph))
+        print("Crashes: ", len(self.crashes))
+        print("Activity Coverage: ", len(self.model.activities) / len(self.model.all_activities))
+
+    def get_summary(self):
+        activities = sorted(activity for activity in self.model.activities if activity)
+        return {
+            "device_serial":        self.device.serial,
+            "events":               self.event_count,
+            "states":               len(self.state_graph),
+            "activities":           activities,
+            "activity_coverage":    len(self.model.activities) / len(self.model.all_activities),
+            "crashes":              [{"device_serial":  self.device.serial,
+                                      "type":           crash.crash_type,
+                                      "tag":            crash.tag,
+                                      "process":        crash.process,
+                                      "exception":      crash.exception} for crash in self.crashes],
+        }
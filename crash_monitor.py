@@ -0,0 +1,181 @@
+import logging
+import queue
+import re
+import threading
+import time
+from shlex import quote
+
+CRASH_JAVA = "crash"
+CRASH_NATIVE = "native_crash"
+CRASH_ANR = "anr"
+
+# 10-18 14:21:03.512  4321  4321 E AndroidRuntime: FATAL EXCEPTION: main
+LOGCAT_LINE_RE = re.compile(r'^(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+(\d+)\s+(\d+)\s+([VDIWEFA])\s+(.*?)\s*: (.*)$')
+JAVA_PROCESS_RE = re.compile(r'^Process: ([^,]+), PID: (\d+)')
+NATIVE_PROCESS_RE = re.compile(r'pid: (\d+), tid: \d+, name: .*>>> (\S+) <<<')
+# am_anr: [0,4321,com.example,952745541,Input dispatching timed out ...]
+ANR_RE = re.compile(r'^\[\d+,(\d+),([^,]+),\d+,(.*)\]$')
+EXCEPTION_RE = re.compile(r'^([\w$.]+(?:Exception|Error)[\w$]*)(?::.*)?$')
+
+LOGCAT_FILTERS = ["AndroidRuntime:*", "DEBUG:*", "libc:*", "am_anr:*", "*:S"]
+
+
+class Crash:
+    def __init__(self, crash_type, time_, pid, lines):
+        self.crash_type = crash_type
+        self.time = time_
+        self.pid = pid
+        self.lines = lines
+        self.process = None
+        self.exception = None
+        self.tag = None
+        self.screenshot_path = None
+        self.detected_time = time.time()
+        self.parse()
+
+    def parse(self):
+        for line in self.lines:
+            if self.crash_type == CRASH_JAVA:
+                m = JAVA_PROCESS_RE.match(line)
+                if m and self.process is None:
+                    self.process = m.group(1)
+                    continue
+                m = EXCEPTION_RE.match(line.strip())
+                if m and self.exception is None:
+                    self.exception = line.strip()
+            elif self.crash_type == CRASH_NATIVE:
+                m = NATIVE_PROCESS_RE.search(line)
+                if m and self.process is None:
+                    self.process = m.group(2)
+                if line.startswith("signal ") and self.exception is None:
+                    self.exception = line
+            elif self.crash_type == CRASH_ANR:
+                m = ANR_RE.match(line)
+                if m:
+                    self.process = m.group(2)
+                    self.exception = "ANR: %s" % m.group(3)
+
+    @property
+    def crash_dict(self):
+        return {
+            "type":             self.crash_type,
+            "tag":              self.tag,
+            "process":          self.process,
+            "pid":              self.pid,
+            "exception":        self.exception,
+            "time":             self.time,
+            "detected_time":    self.detected_time,
+            "screenshot_path":  self.screenshot_path,
+            "lines":            self.lines,
+        }
+
+
+class CrashMonitor:
+    """
+    streams `logcat -b crash -b events` in the background and turns java
+    crashes, native crashes and ANRs of the app into Crash objects as they
+    arrive. each crash is tagged with the EventLog.tag of the event in flight
+    (event_tag) when its first line is read, and handed to the callback as
+    soon as its block is complete.
+    """
+    def __init__(self, device, package_name=None, callback=None, logcat_path=None, idle_time=0.5):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.device = device
+        self.package_name = package_name
+        self.callback = callback
+        self.logcat_path = logcat_path
+        self.idle_time = idle_time
+        self.event_tag = None
+        self.crashes = []
+        self.enabled = False
+        self.stream = None
+        self.lines = queue.Queue()
+        self.block = None
+
+    def start(self):
+        args = ["logcat", "-b", "crash", "-b", "events", "-v", "threadtime"]
+        try:
+            # only what happens from now on
+            args += ["-T", "%s.000" % self.device.adb.shell("date +%s").strip()]
+        except Exception as e:
+            self.logger.warning("failed to read device time: %s" % e)
+        # streamed over the adb server socket, the adb binary is only the fallback
+        self.stream = self.device.adb.shell_stream(" ".join(quote(arg) for arg in args + LOGCAT_FILTERS))
+        self.enabled = True
+        threading.Thread(target=self.read_lines, name="CrashMonitorReader", daemon=True).start()
+        threading.Thread(target=self.run, name="CrashMonitor", daemon=True).start()
+
+    def stop(self):
+        self.enabled = False
+        if self.stream is not None:
+            self.stream.close()
+
+    def read_lines(self):
+        logcat_file = open(self.logcat_path, "a", encoding="utf-8") if self.logcat_path else None
+        try:
+            for line in self.stream:
+                if logcat_file:
+                    logcat_file.write(line + "\n")
+                    logcat_file.flush()
+                self.lines.put(line)
+        finally:
+            if logcat_file:
+                logcat_file.close()
+            self.lines.put(None)
+
+    def run(self):
+        while True:
+            try:
+                line = self.lines.get(timeout=self.idle_time)
+            except queue.Empty:
+                # a crash block is complete once logcat goes quiet
+                self.flush()
+                continue
+            if line is None:
+                self.flush()
+                return
+            self.feed(line)
+
+    def feed(self, line):
+        m = LOGCAT_LINE_RE.match(line)
+        if not m:
+            return
+        time_, pid, _, _, log_tag, message = m.groups()
+        crash_type = None
+        if log_tag == "AndroidRuntime" and message.startswith("FATAL EXCEPTION"):
+            crash_type = CRASH_JAVA
+        elif log_tag == "DEBUG" and message.startswith("*** *** ***"):
+            crash_type = CRASH_NATIVE
+        elif log_tag == "am_anr":
+            crash_type = CRASH_ANR
+
+        if crash_type is not None:
+            self.flush()
+            # the event in flight when the crash starts, flush may only run after the next event was sent
+            self.block = (crash_type, time_, pid, log_tag, [message], self.event_tag)
+        elif self.block is not None and (pid, log_tag) == (self.block[2], self.block[3]):
+            self.block[4].append(message)
+        else:
+            self.flush()
+
+        if crash_type == CRASH_ANR:
+            # an ANR is a single events line
+            self.flush()
+
+    def flush(self):
+        if self.block is None:
+            return
+        crash_type, time_, pid, _, lines, tag = self.block
+        self.block = None
+        crash = Crash(crash_type, time_, pid, lines)
+        if self.package_name and crash.process and not crash.process.startswith(self.package_name):
+            return
+        crash.tag = tag
+        self.crashes.append(crash)
+        self.logger.warning("%s in %s during event %s: %s" % (crash.crash_type, crash.process, crash.tag,
+                                                             crash.exception))
+        if self.callback is not None:
+            try:
+                self.callback(crash)
+            except Exception as e:
+                self.logger.warning("exception in crash callback: %s" % e)
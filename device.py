@@ -1,18 +1,29 @@
+import hashlib
 import logging
 import os.path
 import re
 import subprocess
 import time
+from shlex import quote
 from sys import stdout
 
-import uiautomator2 as u2
-
 from intent import Intent
 from adb import ADB
+from foreground import ForegroundTracker, RESUMED_ACTIVITY_CMD
+from crash_monitor import CrashMonitor
+from profiler import PROFILER
 from app import App
-from utils.tree.trans_xml import xml_to_tree
+from state_graph import get_state_signature
+from utils.tree.compact import parse_compact_hierarchy
 from utils.tree import node
 
+# Total frames rendered: 1234
+IDLE_PROBE_CMD = "dumpsys gfxinfo %s | grep 'Total frames'; " + RESUMED_ACTIVITY_CMD
+
+INSTALL_DEFAULT = "default"
+INSTALL_STREAMING = "streaming"
+INSTALL_INCREMENTAL = "incremental"
+
 
 class DeviceState:
     def __init__(self, device, xml, foreground_activity, tag=None, screenshot_path=None, screenshot_time=None):
@@ -25,15 +36,71 @@ class DeviceState:
         self.screenshot_path = screenshot_path
         self.xml = xml
         self.screenshot_time = screenshot_time
+        self.timestamp = time.time()
+        self._trees = None
+        self._action_index = None
+        self._xml_hash = None
+        self._signature = None
+        # set by the ScreenshotCapturer, the image lands asynchronously
+        self.screenshot_checked = False
+        self.screenshot_future = None
+        self.screenshot_skipped = False
+
+    @property
+    def trees(self):
+        # parsed lazily and shared by everyone looking at this snapshot, the
+        # roots are NodeViews over one CompactTree (see utils/tree/compact.py)
+        if self._trees is None:
+            self.parse()
+        return self._trees
+
+    @property
+    def action_index(self):
+        if self._action_index is None:
+            self.parse()
+        return self._action_index
+
+    def parse(self):
+        with PROFILER.stage("xml_to_tree"):
+            self._trees, self._action_index = parse_compact_hierarchy(self.xml)
+
+    def is_stale(self, max_age):
+        if max_age is None:
+            return False
+        return time.time() - self.timestamp > max_age
+
+    def wait_screenshot(self, timeout=10):
+        if self.screenshot_future is None:
+            return
+        try:
+            self.screenshot_future.result(timeout=timeout)
+        except Exception:
+            pass
 
     @property
     def state_dict(self):
+        self.wait_screenshot()
         return {
             "foreground_activity": self.foreground_activity,
             "screenshot_path": self.screenshot_path,
-            "screenshot_time": self.screenshot_time
+            "screenshot_time": self.screenshot_time,
+            "screenshot_skipped": self.screenshot_skipped,
+            "xml_hash": self.xml_hash,
+            "signature": self.signature
         }
 
+    @property
+    def signature(self):
+        if self._signature is None:
+            self._signature = get_state_signature(self.foreground_activity, self.trees)
+        return self._signature
+
+    @property
+    def xml_hash(self):
+        if self._xml_hash is None:
+            self._xml_hash = hashlib.sha1(self.xml.encode("utf-8")).hexdigest()
+        return self._xml_hash
+
 
 class Display:
     def __init__(self):
@@ -128,12 +195,15 @@ class DeviceInfo:
 
 
 class DeviceUI:
-    def __init__(self, serial=None, output_path=None, grant_permission=None):
+    def __init__(self, serial=None, output_path=None, grant_permission=None, install_mode=INSTALL_STREAMING):
         self.logger = logging.getLogger(self.__class__.__name__)
 
         self.serial = serial
         self.grant_permission = grant_permission
+        self.install_mode = install_mode
         self.adb = ADB(device=self)
+        self.foreground = ForegroundTracker(self)
+        self.crash_monitor = None
         self.ui = None
         self.device_info = DeviceInfo()
         self.output_path = output_path
@@ -142,10 +212,31 @@ class DeviceUI:
                 os.makedirs(output_path)
 
     def connect(self):
+        # imported here so the rest of the loop can run against a simulated device without uiautomator2
+        import uiautomator2 as u2
         self.ui = u2.connect_usb(self.serial)
         self.device_info.get_attribute(self.ui.device_info)
 
     def get_top_activity_name(self):
+        return self.foreground.get()
+
+    def dump_hierarchy(self):
+        with PROFILER.stage("dump_hierarchy"):
+            return self.ui.dump_hierarchy()
+
+    def probe_idle(self, package_name):
+        """
+        a few lines that change while the screen is still moving: the frame
+        count of the app and the resumed activity. far cheaper than a
+        hierarchy dump, None when the query failed
+        """
+        try:
+            with PROFILER.stage("probe_idle"):
+                return self.adb.shell_raw(IDLE_PROBE_CMD % quote(package_name))
+        except subprocess.CalledProcessError:
+            return None
+
+    def dump_top_activity_name(self):
         r = self.adb.shell("dumpsys activity activities")
         # * Hist #0: ActivityRecord{6d65b24 u0 com.bbk.launcher2/.Launcher d0 s0 t1}
         source_activity_line = re.compile('\* Hist #\d+: ActivityRecord{[^ ]+ [^ ]+ ([^ ]+) [^ ]+ [^ ]+ [^ ]+}')
@@ -160,7 +251,7 @@ class DeviceUI:
 
         return None
 
-    def is_foreground(self, app):
+    def is_foreground(self, app, state=None):
         if isinstance(app, str):
             package_name = app
         elif isinstance(app, App):
@@ -169,40 +260,61 @@ class DeviceUI:
             self.logger.error("package name is null")
             package_name = ""
 
-        top_activity_name = self.get_top_activity_name()
+        if state is not None:
+            top_activity_name = state.foreground_activity
+        else:
+            top_activity_name = self.get_top_activity_name()
         if top_activity_name is None:
             print("top_activity is None")
             return False
         return top_activity_name.startswith(package_name)
 
     def start_app(self, app):
+        self.foreground.invalidate()
         self.ui.app_start(app.package_name)
 
+    def get_install_args(self):
+        if self.install_mode == INSTALL_INCREMENTAL:
+            return ["--incremental"]
+        if self.install_mode == INSTALL_STREAMING and int(self.device_info.sdk or 0) >= 30:
+            return ["--streaming"]
+        return []
+
+    def run_package_cmd(self, args):
+        r = subprocess.run(self.adb.cmd_prefix + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = r.stdout.decode("utf-8", "replace").strip()
+        return r.returncode == 0 and "Success" in output, output
+
     def install_app(self, app):
         assert isinstance(app, App)
         package_name = app.package_name
-        if package_name not in self.adb.get_installed_apps():
-            install_cmd = ["adb", "-s", self.serial, "install"]
-            if self.grant_permission:
-                install_cmd.append("-g")
-            install_cmd.append(app.apk_path)
-            install_p = subprocess.Popen(install_cmd, stdout=subprocess.PIPE)
-            while package_name not in self.adb.get_installed_apps():
-                print("Please wait while installing the app...")
-                time.sleep(2)
+        if self.adb.is_installed(package_name):
+            return
+        print("Please wait while installing the app...")
+        install_cmd = ["install"]
+        if self.grant_permission:
+            install_cmd.append("-g")
+        install_args = self.get_install_args()
+        success, output = self.run_package_cmd(install_cmd + install_args + [app.apk_path])
+        if not success and install_args:
+            # e.g. no v4 signature for incremental install, retry with a plain install
+            self.logger.warning("install with %s failed, retrying: %s" % (" ".join(install_args), output))
+            success, output = self.run_package_cmd(install_cmd + [app.apk_path])
+        self.adb.invalidate_installed(package_name)
+        if not success or not self.adb.is_installed(package_name):
+            raise RuntimeError("failed to install %s: %s" % (package_name, output))
 
     def uninstall_app(self, app):
         if isinstance(app, App):
             package_name = app.package_name
         else:
             package_name = app
-        if package_name in self.adb.get_installed_apps():
-            uninstall_cmd = ["adb", "-s", self.serial, "uninstall", package_name]
-            uninstall_p = subprocess.Popen(uninstall_cmd, stdout=subprocess.PIPE)
-            while package_name in self.adb.get_installed_apps():
-                print("Please wait while uninstalling the app...")
-                time.sleep(2)
-            # uninstall_p.terminate()
+        if self.adb.is_installed(package_name):
+            print("Please wait while uninstalling the app...")
+            success, output = self.run_package_cmd(["uninstall", package_name])
+            self.adb.invalidate_installed(package_name)
+            if not success or self.adb.is_installed(package_name):
+                self.logger.warning("failed to uninstall %s: %s" % (package_name, output))
 
     def push_file(self, local_file, remote_dir="/sdcard/"):
         if not os.path.exists(local_file):
@@ -212,29 +324,17 @@ class DeviceUI:
     def pull_file(self, remote_file, local_file):
         self.adb.run_cmd(["pull", remote_file, local_file])
 
-    def take_screenshot(self):
-        timestamp = int(time.time() * 1000)
-        local_image_dir = os.path.join(self.output_path, "temp")
-        if not os.path.exists(local_image_dir):
-            os.makedirs(local_image_dir)
-        local_image_path = os.path.join(local_image_dir, "%s_%s.png" % (self.serial, timestamp))
-        self.ui.screenshot(local_image_path)
-        return local_image_path,  timestamp
-
     def get_current_state(self):
         self.logger.debug("getting current device state...")
         current_state = None
         try:
-            xml = self.ui.dump_hierarchy()
-            tree = xml_to_tree(xml)
+            xml = self.dump_hierarchy()
             foreground_activity = self.get_top_activity_name()
-            screenshot_path, timestamp = self.take_screenshot()
             self.logger.debug("finish getting current device state...")
+            # screenshots are taken asynchronously by the controller's ScreenshotCapturer
             current_state = DeviceState(self,
                                         xml=xml,
-                                        foreground_activity=foreground_activity,
-                                        screenshot_path=screenshot_path,
-                                        screenshot_time=timestamp
+                                        foreground_activity=foreground_activity
                                        )
         except Exception as e:
             self.logger.warning("exception in get_current_state: %s" % e)
@@ -245,18 +345,19 @@ class DeviceUI:
             self.logger.warning("Failed to get current state!")
         return current_state
 
-    def get_screenshot_time(self, screenshot_path):
-        screenshot_time = screenshot_path[screenshot_path.find('_')+1 : screenshot_path.find('.')]
-        return screenshot_time
-
-    def logcat(self):
+    def logcat(self, package_name=None, callback=None):
+        """
+        start streaming the crash log, raw lines are kept in <serial>-logcat.txt
+        """
         path = os.path.join(self.output_path, self.serial + "-logcat.txt")
         index = 1
         while os.path.exists(path):
             path = os.path.join(self.output_path, self.serial + "-logcat" + str(index) + ".txt")
             index += 1
 
-        subprocess.run(["adb", "-s", self.serial,"push", "logcat", "-b", "crash",  ">", path])
+        self.crash_monitor = CrashMonitor(self, package_name=package_name, callback=callback, logcat_path=path)
+        self.crash_monitor.start()
+        return self.crash_monitor
 
     def wait_for_device(self):
         try:
@@ -268,6 +369,8 @@ class DeviceUI:
         self.wait_for_device()
 
     def stop(self):
+        if self.crash_monitor is not None:
+            self.crash_monitor.stop()
         self.ui.stop()
 
     def send_intent(self, intent):
@@ -276,10 +379,13 @@ class DeviceUI:
         else:
             cmd = intent
         print("Intent Event: ", cmd)
+        self.foreground.invalidate()
         return self.adb.shell(cmd)
 
     def send_event(self, event):
-        event.send(self)
+        self.foreground.invalidate()
+        with PROFILER.stage("send_event"):
+            event.send(self)
 
 
 
@@ -8,6 +8,38 @@ from intent import Intent
 from utils.tree.node import ACTION_CLICK, ACTION_LONG_CLICK, ACTION_SCROLL_LEFT_TO_RIGHT, ACTION_SCROLL_RIGHT_TO_LEFT, \
     ACTION_SCROLL_UP_TO_DOWN, ACTION_SCROLL_DOWN_TO_UP, ACTION_EDIT, ACTION_UIAUTOMATOR, ACTION_INTENT, ACTION_KEY_EVENT
 
+LONG_CLICK_DURATION = 1000
+SWIPE_DURATION = 200
+
+_last_tag = 0
+_tag_lock = threading.Lock()
+
+
+def next_tag():
+    """
+    millisecond timestamp, bumped when needed so tags stay unique within a batch
+    """
+    global _last_tag
+    with _tag_lock:
+        _last_tag = max(int(round(time.time() * 1000)), _last_tag + 1)
+        return _last_tag
+
+
+def get_swipe_cmd(direction, left_x, left_y, right_x, right_y):
+    """
+    `input swipe` across the middle 60% of the box, direction is where the finger moves
+    """
+    x = (left_x + right_x) // 2
+    y = (left_y + right_y) // 2
+    start_x, start_y, end_x, end_y = x, y, x, y
+    if direction in ("up", "down"):
+        near, far = left_y + (right_y - left_y) // 5, right_y - (right_y - left_y) // 5
+        start_y, end_y = (far, near) if direction == "up" else (near, far)
+    else:
+        near, far = left_x + (right_x - left_x) // 5, right_x - (right_x - left_x) // 5
+        start_x, end_x = (far, near) if direction == "left" else (near, far)
+    return "input swipe %d %d %d %d %d" % (start_x, start_y, end_x, end_y, SWIPE_DURATION)
+
 
 class Event:
     def __init__(self, node=None, action_type=None):
@@ -33,6 +65,12 @@ class Event:
     def send(self, device):
         raise NotImplementedError
 
+    def get_input_cmd(self):
+        """
+        the event as a device shell command line, used to send a batch of events in one shell call
+        """
+        raise NotImplementedError
+
     @property
     def event_json(self):
         event_dict = {"action":         self.action_type,
@@ -67,6 +105,9 @@ class ClickEvent(Event):
         device.ui.click(self.x, self.y)
         return True
 
+    def get_input_cmd(self):
+        return "input tap %d %d" % (self.x, self.y)
+
 
 class LongClickEvent(Event):
     def __init__(self, node):
@@ -80,6 +121,9 @@ class LongClickEvent(Event):
         device.ui.long_click(self.x, self.y)
         return True
 
+    def get_input_cmd(self):
+        return "input swipe %d %d %d %d %d" % (self.x, self.y, self.x, self.y, LONG_CLICK_DURATION)
+
 
 class ScrollUpEvent(Event):
     def __init__(self, node):
@@ -95,6 +139,9 @@ class ScrollUpEvent(Event):
         device.ui.swipe_ext("up", box=(self.left_x, self.left_y, self.right_x, self.right_y))
         return True
 
+    def get_input_cmd(self):
+        return get_swipe_cmd("up", self.left_x, self.left_y, self.right_x, self.right_y)
+
 
 class ScrollDownEvent(Event):
     def __init__(self, node):
@@ -110,6 +157,9 @@ class ScrollDownEvent(Event):
         device.ui.swipe_ext("down", box=(self.left_x, self.left_y, self.right_x, self.right_y))
         return True
 
+    def get_input_cmd(self):
+        return get_swipe_cmd("down", self.left_x, self.left_y, self.right_x, self.right_y)
+
 
 class ScrollRightEvent(Event):
     def __init__(self, node):
@@ -125,6 +175,9 @@ class ScrollRightEvent(Event):
         device.ui.swipe_ext("right", box=(self.left_x, self.left_y, self.right_x, self.right_y))
         return True
 
+    def get_input_cmd(self):
+        return get_swipe_cmd("right", self.left_x, self.left_y, self.right_x, self.right_y)
+
 
 class ScrollLeftEvent(Event):
     def __init__(self, node):
@@ -140,6 +193,9 @@ class ScrollLeftEvent(Event):
         device.ui.swipe_ext("left", box=(self.left_x, self.left_y, self.right_x, self.right_y))
         return True
 
+    def get_input_cmd(self):
+        return get_swipe_cmd("left", self.left_x, self.left_y, self.right_x, self.right_y)
+
 
 class IntentEvent(Event):
     def __init__(self, intent=None):
@@ -155,6 +211,9 @@ class IntentEvent(Event):
         print("send start app intent")
         return True
 
+    def get_input_cmd(self):
+        return self.intent
+
     @property
     def event_json(self):
         event_dict = {"action":  self.action_type,
@@ -177,6 +236,9 @@ class KeyEvent(Event):
         device.ui.press(self.name)
         return True
 
+    def get_input_cmd(self):
+        return "input keyevent KEYCODE_%s" % self.name.upper()
+
     @property
     def event_json(self):
         event_dict = {"action":     self.action_type,
@@ -191,15 +253,20 @@ class KeyEvent(Event):
 
 
 class EventLog:
-    def __init__(self, device, app, event, tag=None):
+    def __init__(self, device, app, event, tag=None, writer=None):
         self.device = device
         self.app = app
         self.event = event
         if tag is None:
-            tag = int(round(time.time() * 1000))
+            tag = next_tag()
         self.tag = tag
         self.from_state = None
         self.to_state = None
+        self.writer = writer
+        # seconds between sending the event and capturing to_state
+        self.settle_time = None
+        # {"id", "index", "size"} when the event was sent as part of a batch
+        self.batch = None
 
     def to_dict(self):
         return{
@@ -207,45 +274,53 @@ class EventLog:
             "event":        self.event.event_dict,
             "from_state":   self.from_state.state_dict,
             "to_state":     self.to_state.state_dict,
+            "settle_time":  self.settle_time,
+            "batch":        self.batch,
         }
 
-    def start(self):
-        self.from_state = self.device.get_current_state()
+    def start(self, from_state=None):
+        # the previous event's to_state is the same screen, so reuse it when given
+        if from_state is None:
+            from_state = self.device.get_current_state()
+        self.from_state = from_state
         self.device.send_event(self.event)
 
     def stop(self):
-        self.to_state = self.device.get_current_state()
-        save_thread = threading.Thread(target=self.save())
-        save_thread.start()
+        self.finish(self.device.get_current_state())
 
-    def save(self):
-        events_output_path = os.path.join(self.device.output_path, "events")
-        if not os.path.exists(events_output_path):
-            os.makedirs(events_output_path)
+    def finish(self, to_state):
+        self.to_state = to_state
+        if self.writer is not None:
+            self.writer.put(self)
+        else:
+            self.save()
 
-        # write event json
+    def get_event_file(self):
+        events_output_path = os.path.join(self.device.output_path, "events")
         event_json_file_path = "%s/event_%s.json" % (events_output_path, self.tag)
-        event_json_file = open(event_json_file_path, "w")
-        json.dump(self.to_dict(), event_json_file, indent=2)
-        event_json_file.close()
-
-        # write tree
-        from_xml        = self.from_state.xml
-        to_xml          = self.to_state.xml
-        from_xml_time   = self.from_state.screenshot_time
-        to_xml_time     = self.to_state.screenshot_time
-        xml_output_path = os.path.join(self.device.output_path, "xmls")
-        if not os.path.exists(xml_output_path):
-            os.makedirs(xml_output_path)
-
-        from_xml_path = "%s/%s.xml" % (xml_output_path, from_xml_time)
-        with open(from_xml_path, "w", encoding="utf-8") as f:
-            f.write(from_xml)
-            f.close()
-
-        to_xml_path = "%s/%s.xml" % (xml_output_path, to_xml_time)
-        with open(to_xml_path, "w", encoding="utf-8") as f:
-            f.write(to_xml)
-            f.close()
+        return event_json_file_path, json.dumps(self.to_dict(), indent=2)
 
+    def get_xml_files(self):
+        """
+        hierarchies are content addressed, xmls/<xml_hash>.xml, so a screen
+        seen many times is stored once
+        """
+        xml_output_path = os.path.join(self.device.output_path, "xmls")
+        xml_files = []
+        for state in (self.from_state, self.to_state):
+            xml_files.append(("%s/%s.xml" % (xml_output_path, state.xml_hash), state.xml))
+        return xml_files
 
+    def save(self):
+        write_file(*self.get_event_file())
+        for path, content in self.get_xml_files():
+            if not os.path.exists(path):
+                write_file(path, content)
+
+
+def write_file(path, content):
+    dir_path = os.path.dirname(path)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
@@ -0,0 +1,196 @@
+import json
+import os
+import struct
+import zlib
+
+TRACE_FILE_NAME = "trace.bin"
+TRACE_INDEX_NAME = "trace.idx"
+TRACE_MAGIC = b"CDTRACE1"
+
+RECORD_EVENT = b"E"
+RECORD_STATE = b"S"
+# record header: type, payload length
+RECORD_HEADER = struct.Struct(">cI")
+
+
+def get_trace_paths(path):
+    """
+    path is either a run output directory or a trace file
+    """
+    if os.path.isfile(path):
+        return path, os.path.splitext(path)[0] + ".idx"
+    return os.path.join(path, TRACE_FILE_NAME), os.path.join(path, TRACE_INDEX_NAME)
+
+
+class TraceWriter:
+    """
+    run-level append-only trace: a magic header followed by length-prefixed,
+    zlib compressed json records, plus a text index of "<type> <key> <offset>"
+    lines. event records reference their hierarchies by xml_hash, each
+    distinct hierarchy is stored once as a state record.
+    """
+    def __init__(self, output_path, compress_level=6):
+        self.trace_path = os.path.join(output_path, TRACE_FILE_NAME)
+        self.index_path = os.path.join(output_path, TRACE_INDEX_NAME)
+        self.compress_level = compress_level
+        if not os.path.exists(output_path):
+            os.makedirs(output_path, exist_ok=True)
+
+        self.trace_file = open(self.trace_path, "ab")
+        if self.trace_file.tell() == 0:
+            self.trace_file.write(TRACE_MAGIC)
+        self.index_file = open(self.index_path, "a", encoding="utf-8")
+        self.stored_xmls = set()
+
+    def append(self, record_type, record):
+        payload = zlib.compress(json.dumps(record).encode("utf-8"), self.compress_level)
+        offset = self.trace_file.tell()
+        self.trace_file.write(RECORD_HEADER.pack(record_type, len(payload)))
+        self.trace_file.write(payload)
+        return offset
+
+    def append_state(self, state):
+        if state.xml_hash in self.stored_xmls:
+            return
+        offset = self.append(RECORD_STATE, {"xml_hash": state.xml_hash, "xml": state.xml})
+        self.index_file.write("%s %s %s\n" % (RECORD_STATE.decode(), state.xml_hash, offset))
+        self.stored_xmls.add(state.xml_hash)
+
+    def append_event(self, event_log):
+        self.append_state(event_log.from_state)
+        self.append_state(event_log.to_state)
+        offset = self.append(RECORD_EVENT, event_log.to_dict())
+        self.index_file.write("%s %s %s\n" % (RECORD_EVENT.decode(), event_log.tag, offset))
+
+    def write_batch(self, event_logs):
+        for event_log in event_logs:
+            self.append_event(event_log)
+        self.trace_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.trace_file.close()
+        self.index_file.close()
+
+
+class TraceReader:
+    """
+    streaming reader for a TraceWriter trace, records are decoded one at a time
+    """
+    def __init__(self, path):
+        self.trace_path, self.index_path = get_trace_paths(path)
+        self.trace_file = open(self.trace_path, "rb")
+        if self.trace_file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("not a trace file: %s" % self.trace_path)
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.trace_file.close()
+
+    def read_header(self):
+        header = self.trace_file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        return RECORD_HEADER.unpack(header)
+
+    def read_record(self):
+        """
+        read the record at the current position, None at the end of the trace
+        (a record truncated by an interrupted run also ends the trace)
+        """
+        header = self.read_header()
+        if header is None:
+            return None
+        record_type, length = header
+        payload = self.trace_file.read(length)
+        if len(payload) < length:
+            return None
+        return record_type, json.loads(zlib.decompress(payload).decode("utf-8"))
+
+    def records(self, offset=None):
+        self.trace_file.seek(len(TRACE_MAGIC) if offset is None else offset)
+        while True:
+            record = self.read_record()
+            if record is None:
+                return
+            yield record
+
+    def events(self, offset=None):
+        for record_type, record in self.records(offset):
+            if record_type == RECORD_EVENT:
+                yield record
+
+    def __iter__(self):
+        return self.events()
+
+    @property
+    def index(self):
+        """
+        {record type: {key: offset}}, keys are event tags and xml hashes
+        """
+        if self._index is None:
+            self._index = self.load_index()
+        return self._index
+
+    def load_index(self):
+        index = {RECORD_EVENT: {}, RECORD_STATE: {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 3:
+                        index.setdefault(parts[0].encode(), {})[parts[1]] = int(parts[2])
+            return index
+
+        # no index (e.g. an interrupted run), rebuild it with one scan
+        position = self.trace_file.tell()
+        self.trace_file.seek(len(TRACE_MAGIC))
+        while True:
+            offset = self.trace_file.tell()
+            record = self.read_record()
+            if record is None:
+                break
+            record_type, record = record
+            if record_type == RECORD_EVENT:
+                index[RECORD_EVENT][str(record["tag"])] = offset
+            elif record_type == RECORD_STATE:
+                index[RECORD_STATE][record["xml_hash"]] = offset
+        self.trace_file.seek(position)
+        return index
+
+    def read_at(self, offset):
+        position = self.trace_file.tell()
+        self.trace_file.seek(offset)
+        record = self.read_record()
+        self.trace_file.seek(position)
+        return record[1] if record else None
+
+    def get_xml(self, xml_hash):
+        offset = self.index[RECORD_STATE].get(xml_hash)
+        if offset is None:
+            return None
+        record = self.read_at(offset)
+        return record["xml"] if record else None
+
+    def seek(self, tag):
+        """
+        position the reader at the event with the given tag and return it
+        """
+        offset = self.index[RECORD_EVENT].get(str(tag))
+        if offset is None:
+            return None
+        self.trace_file.seek(offset)
+        record = self.read_record()
+        return record[1] if record else None
+
+    def events_from(self, tag):
+        offset = self.index[RECORD_EVENT].get(str(tag))
+        if offset is None:
+            return iter(())
+        return self.events(offset)
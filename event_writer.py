@@ -0,0 +1,135 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from event import write_file
+from profiler import PROFILER
+
+
+class FileStore:
+    """
+    stores every event log as events/event_<tag>.json, the hierarchies go to
+    xmls/<xml_hash>.xml and each distinct one is written only once
+    """
+    def __init__(self):
+        self.stored_xmls = set()
+
+    def write_batch(self, event_logs):
+        for event_log in event_logs:
+            write_file(*event_log.get_event_file())
+            for path, content in event_log.get_xml_files():
+                if path in self.stored_xmls:
+                    continue
+                if not os.path.exists(path):
+                    write_file(path, content)
+                self.stored_xmls.add(path)
+
+    def close(self):
+        pass
+
+
+class EventLogWriter:
+    """
+    background writer for EventLog, so the exploration loop never waits on disk.
+    event logs are queued (bounded, the producer waits when the writer falls
+    behind) and handed to the store in batches.
+    """
+    def __init__(self, store=None, max_queue_size=256, batch_size=32):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if store is None:
+            store = FileStore()
+        self.store = store
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.closed = False
+        self.lock = threading.Lock()
+
+        self.written_events = 0
+        self.written_batches = 0
+        self.blocked_time = 0
+        self.last_write_latency = 0
+        self.max_write_latency = 0
+        self.total_write_latency = 0
+
+        self.thread = threading.Thread(target=self.run, name="EventLogWriter", daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    @property
+    def stats(self):
+        avg_latency = self.total_write_latency / self.written_batches if self.written_batches else 0
+        return {
+            "queue_depth":          self.queue_depth,
+            "written_events":       self.written_events,
+            "written_batches":      self.written_batches,
+            "blocked_time":         self.blocked_time,
+            "last_write_latency":   self.last_write_latency,
+            "avg_write_latency":    avg_latency,
+            "max_write_latency":    self.max_write_latency,
+        }
+
+    def put(self, event_log):
+        with self.lock:
+            if not self.closed:
+                try:
+                    self.queue.put_nowait(event_log)
+                except queue.Full:
+                    # backpressure: wait for the writer rather than dropping logs
+                    self.logger.warning("event log queue is full, waiting for writer...")
+                    start = time.time()
+                    self.queue.put(event_log)
+                    self.blocked_time += time.time() - start
+                return
+        self.logger.warning("event log writer is closed, dropping event %s" % event_log.tag)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            event_logs = [event_log for event_log in batch if event_log is not None]
+            try:
+                if event_logs:
+                    self.write_batch(event_logs)
+            except Exception as e:
+                self.logger.warning("exception while writing event logs: %s" % e)
+                import traceback
+                traceback.print_exc()
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if len(event_logs) < len(batch):
+                return
+
+    def write_batch(self, event_logs):
+        start = time.time()
+        with PROFILER.stage("event_log_save"):
+            self.store.write_batch(event_logs)
+
+        latency = time.time() - start
+        self.written_events += len(event_logs)
+        self.written_batches += 1
+        self.last_write_latency = latency
+        self.total_write_latency += latency
+        self.max_write_latency = max(self.max_write_latency, latency)
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+        self.store.close()
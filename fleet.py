@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from adb import get_devices
+from app import App
+from single_bot import SingleBot
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start auto detect crash bugs on several devices.",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--device_serials", action="store", dest="device_serials", nargs="*", required=False,
+                        help="devices to run on, default is every device listed by `adb devices`")
+    parser.add_argument("--apk_path", action="store", dest="apk_path", required=True)
+    parser.add_argument("--timeout", action="store", dest="timeout", type=int, required=False, default=60,
+                        help="test time(minutes) default is 60 minutes")
+    parser.add_argument("--throttle", action="store", dest="throttle", type=int, required=False, default=500,
+                        help="time gaps between two events")
+    parser.add_argument("--settle_mode", action="store", dest="settle_mode", required=False, default="fixed",
+                        choices=["fixed", "adaptive"],
+                        help="fixed sleeps throttle ms after every event,\n"
+                             "adaptive waits until the hierarchy stops changing, at most throttle ms")
+    parser.add_argument("--output_path", action="store", dest="output_path", required=False, default='./output/')
+    parser.add_argument("--keep_app", action="store_true", dest="keep_app", required=False)
+    parser.add_argument("--model_name", action="store", dest="model_name", required=False, default='random',
+                        choices=["random", "coverage"],
+                        help="random picks widgets uniformly,\n"
+                             "coverage favours actions not yet tried on the current screen")
+    parser.add_argument("--grant_permission", action="store", dest="grant_permission", required=False, default=True)
+    parser.add_argument("--trace", action="store_true", dest="trace", required=False,
+                        help="store events in one compressed trace file instead of one file per event")
+    parser.add_argument("--install_mode", action="store", dest="install_mode", required=False, default="streaming",
+                        choices=["default", "streaming", "incremental"],
+                        help="adb install mode, incremental needs an apk with a v4 signature")
+    parser.add_argument("--screenshot_policy", action="store", dest="screenshot_policy", required=False,
+                        default="every_n", choices=["never", "new_state", "crash", "every_n"],
+                        help="which states get a screenshot, default is every_n")
+    parser.add_argument("--screenshot_every", action="store", dest="screenshot_every", type=int, required=False,
+                        default=1, help="n for the every_n screenshot policy")
+    parser.add_argument("--screenshot_scale", action="store", dest="screenshot_scale", type=float, required=False,
+                        default=1.0, help="downscale factor of the screenshots, e.g. 0.5")
+    parser.add_argument("--screenshot_format", action="store", dest="screenshot_format", required=False,
+                        default="png", choices=["png", "jpeg"])
+    parser.add_argument("--batch_size", action="store", dest="batch_size", type=int, required=False, default=1,
+                        help="events planned from one state and sent in one shell call, default is 1 (no batching)")
+    parser.add_argument("--metrics_interval", action="store", dest="metrics_interval", type=int, required=False,
+                        default=30, help="seconds between exports of metrics.json/metrics.prom to output_path")
+    parser.add_argument("--launch_activities", action="store_true", dest="launch_activities", required=False,
+                        help="start every activity of the manifest with am start before exploring the ui,\n"
+                             "launch crashes are listed in activity_launch.json")
+
+    options = parser.parse_args()
+    return options
+
+
+def run_bot(device_serial, app, options):
+    """
+    worker process: one SingleBot on one device, output goes to output_path/<serial>
+    """
+    summary = None
+    try:
+        bot = SingleBot(
+            device_serial     = device_serial,
+            package_name      = app.package_name,
+            apk_path          = app.apk_path,
+            timeout           = options["timeout"],
+            throttle          = options["throttle"],
+            output_path       = os.path.join(options["output_path"], device_serial),
+            keep_app          = options["keep_app"],
+            model_name        = options["model_name"],
+            grant_permission  = options["grant_permission"],
+            trace             = options["trace"],
+            install_mode      = options["install_mode"],
+            settle_mode       = options["settle_mode"],
+            screenshot_policy = options["screenshot_policy"],
+            screenshot_every  = options["screenshot_every"],
+            screenshot_scale  = options["screenshot_scale"],
+            screenshot_format = options["screenshot_format"],
+            batch_size        = options["batch_size"],
+            metrics_interval  = options["metrics_interval"],
+            launch_activities = options["launch_activities"],
+            app               = app
+        )
+        summary = bot.start()
+    except SystemExit:
+        pass
+    except Exception as e:
+        logging.getLogger("Fleet").warning("device %s failed: %s" % (device_serial, e))
+    if summary is None:
+        summary = {"device_serial": device_serial, "failed": True}
+    return summary
+
+
+def get_fleet_summary(app, summaries):
+    activities = set()
+    crashes = []
+    for summary in summaries:
+        activities.update(summary.get("activities", []))
+        crashes.extend(summary.get("crashes", []))
+    all_activities = app.activities
+    return {
+        "package_name":         app.package_name,
+        "devices":              summaries,
+        "events":               sum(summary.get("events", 0) for summary in summaries),
+        "activities":           sorted(activities),
+        "activity_coverage":    len(activities) / len(all_activities) if all_activities else 0,
+        "crashes":              crashes,
+    }
+
+
+class Fleet:
+    def __init__(self, device_serials, apk_path, options):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        if not device_serials:
+            device_serials = get_devices()
+        self.device_serials = device_serials
+        self.options = options
+        self.app = App(apk_path)
+
+    def start(self):
+        self.logger.info("start fleet on %s" % ", ".join(self.device_serials))
+        if not self.device_serials:
+            self.logger.warning("no device found")
+            return None
+        with ProcessPoolExecutor(max_workers=len(self.device_serials)) as executor:
+            futures = [executor.submit(run_bot, serial, self.app, self.options) for serial in self.device_serials]
+            summaries = [future.result() for future in futures]
+
+        fleet_summary = get_fleet_summary(self.app, summaries)
+        if not os.path.isdir(self.options["output_path"]):
+            os.makedirs(self.options["output_path"])
+        with open(os.path.join(self.options["output_path"], "fleet_summary.json"), "w", encoding="utf-8") as f:
+            json.dump(fleet_summary, f, indent=2)
+        print("Fleet Activity Coverage: ", fleet_summary["activity_coverage"])
+        print("Fleet Crashes: ", len(fleet_summary["crashes"]))
+        return fleet_summary
+
+
+def main():
+    opts = parse_args()
+    options = {
+        "timeout":           opts.timeout,
+        "throttle":          opts.throttle,
+        "output_path":       opts.output_path,
+        "keep_app":          opts.keep_app,
+        "model_name":        opts.model_name,
+        "grant_permission":  opts.grant_permission,
+        "trace":             opts.trace,
+        "install_mode":      opts.install_mode,
+        "settle_mode":       opts.settle_mode,
+        "screenshot_policy": opts.screenshot_policy,
+        "screenshot_every":  opts.screenshot_every,
+        "screenshot_scale":  opts.screenshot_scale,
+        "screenshot_format": opts.screenshot_format,
+        "batch_size":        opts.batch_size,
+        "metrics_interval":  opts.metrics_interval,
+        "launch_activities": opts.launch_activities,
+    }
+    fleet = Fleet(opts.device_serials, opts.apk_path, options)
+    fleet.start()
+    return
+
+
+if __name__ == '__main__':
+    main()
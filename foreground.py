@@ -0,0 +1,47 @@
+import re
+import subprocess
+import threading
+
+from profiler import PROFILER
+
+# mResumedActivity: ActivityRecord{6d65b24 u0 com.bbk.launcher2/.Launcher t1}
+# topResumedActivity=ActivityRecord{6d65b24 u0 com.bbk.launcher2/.Launcher t1}
+RESUMED_ACTIVITY_RE = re.compile(r'ResumedActivity[:=] ?ActivityRecord\{[^ ]+ [^ ]+ ([^ }]+)')
+RESUMED_ACTIVITY_CMD = "dumpsys activity activities | grep ResumedActivity"
+
+
+class ForegroundTracker:
+    """
+    caches the foreground activity, the device is only asked again after an
+    event was sent (invalidate). the query greps the resumed activity lines on
+    the device so only a few lines come back instead of the whole dumpsys.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.activity = None
+        self.valid = False
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.valid = False
+
+    def get(self):
+        with self.lock:
+            if not self.valid:
+                with PROFILER.stage("get_top_activity_name"):
+                    self.activity = self.query()
+                self.valid = self.activity is not None
+            return self.activity
+
+    def query(self):
+        try:
+            r = self.device.adb.shell_raw(RESUMED_ACTIVITY_CMD)
+        except subprocess.CalledProcessError:
+            # grep exits non-zero when nothing matched
+            r = ""
+        m = RESUMED_ACTIVITY_RE.search(r)
+        if m:
+            return m.group(1)
+        # unknown dumpsys layout, parse the full dump
+        return self.device.dump_top_activity_name()
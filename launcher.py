@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import time
+
+from app import get_activity_class
+from event import IntentEvent
+from intent import Intent
+
+LAUNCH_OK = "launched"
+LAUNCH_CRASH = "crash"
+LAUNCH_FAILED = "failed"
+
+ACTIVITY_LAUNCH_FILE_NAME = "activity_launch.json"
+
+# activities often read an id, a url or a position from their intent and
+# crash without them, these are sent on a second try
+COMMON_EXTRAS = [
+    ("--es", "id",          "1"),
+    ("--es", "url",         "https://example.com"),
+    ("--es", "title",       "test"),
+    ("--es", "name",        "test"),
+    ("--es", "type",        "test"),
+    ("--ei", "position",    "0"),
+    ("--ei", "index",       "0"),
+    ("--el", "time",        "0"),
+    ("--ez", "flag",        "true"),
+    ("--eu", "uri",         "content://test"),
+]
+
+
+def get_extras_args(extras=COMMON_EXTRAS):
+    return " ".join("%s %s %s" % extra for extra in extras)
+
+
+class ActivityLauncher:
+    """
+    exploration phase run before the model: every activity of the manifest
+    is started directly with `am start -S -n`, first bare and, when that does
+    not bring it to the front, again with COMMON_EXTRAS. launches go through
+    Controller.add_event, so they are logged, tagged for the crash monitor and
+    counted for coverage like any other event. the outcome of every activity
+    is written to activity_launch.json.
+    """
+    def __init__(self, controller, crash_wait=1):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.controller = controller
+        self.device = controller.device
+        self.app = controller.app
+        # seconds to wait for logcat when the activity did not come up
+        self.crash_wait = crash_wait
+        self.results = []
+
+    def get_intent(self, activity, extras=False):
+        suffix = "-S -n %s/%s" % (self.app.package_name, activity)
+        if extras:
+            suffix += " " + get_extras_args()
+        return Intent(suffix=suffix)
+
+    def get_crashes(self, tag):
+        return [crash for crash in self.controller.crashes if crash.tag == tag]
+
+    def launch(self, activity, extras=False):
+        self.controller.add_event(IntentEvent(self.get_intent(activity, extras)))
+        event_log = self.controller.event_log
+        self.controller.model.get_coverage(self.controller)
+        to_state = event_log.to_state
+        if to_state is not None and get_activity_class(to_state.foreground_activity) == activity:
+            crashes = self.get_crashes(event_log.tag)
+        else:
+            deadline = time.time() + self.crash_wait
+            while not self.get_crashes(event_log.tag) and time.time() < deadline:
+                time.sleep(0.1)
+            crashes = self.get_crashes(event_log.tag)
+        if crashes:
+            result = LAUNCH_CRASH
+        elif to_state is not None and get_activity_class(to_state.foreground_activity) == activity:
+            result = LAUNCH_OK
+        else:
+            # not exported, finished right away or redirected elsewhere
+            result = LAUNCH_FAILED
+        return {
+            "activity":     activity,
+            "extras":       extras,
+            "result":       result,
+            "tag":          event_log.tag,
+            "foreground":   to_state.foreground_activity if to_state is not None else None,
+            "crashes":      [crash.exception for crash in crashes],
+        }
+
+    def run(self):
+        for activity in self.app.activities:
+            if not self.controller.enabled:
+                break
+            try:
+                result = self.launch(activity)
+                self.results.append(result)
+                if result["result"] != LAUNCH_OK and self.controller.enabled:
+                    self.results.append(self.launch(activity, extras=True))
+            except Exception as e:
+                self.logger.warning("exception while launching %s: %s" % (activity, e))
+        self.controller.invalidate_state()
+        self.save()
+        launched = set(result["activity"] for result in self.results if result["result"] == LAUNCH_OK)
+        crashed = set(result["activity"] for result in self.results if result["result"] == LAUNCH_CRASH)
+        self.logger.info("launched %d of %d activities directly, %d crashed on launch" %
+                         (len(launched), len(self.app.activities), len(crashed)))
+        return self.results
+
+    def save(self):
+        path = os.path.join(self.device.output_path, ACTIVITY_LAUNCH_FILE_NAME)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.results, f, indent=2)
@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from event import write_file
+from replay import Replayer, load_events, load_crash_tags, load_crash
+
+
+def split(items, n):
+    """
+    n chunks of nearly equal size, in order
+    """
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + (len(items) - start) // (n - i)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+class Minimizer:
+    """
+    ddmin over a crashing event sequence. every round the candidate subsets
+    and complements are replayed in order, as many at a time as there are
+    replayers (one per device), the first candidate that still reproduces the
+    target crash becomes the new sequence. results are cached by the tags of
+    the candidate.
+    """
+    def __init__(self, replayers, target=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.replayers = queue.Queue()
+        for replayer in replayers:
+            self.replayers.put(replayer)
+        self.workers = len(replayers)
+        self.target = target
+        self.cache = {}
+        self.tests = 0
+
+    def test(self, events):
+        key = tuple(event_log["tag"] for event_log in events)
+        if key in self.cache:
+            return self.cache[key]
+        replayer = self.replayers.get()
+        try:
+            result = replayer.replay(events, target=self.target)
+        finally:
+            self.replayers.put(replayer)
+        self.tests += 1
+        reproduced = result.reproduced
+        self.logger.info("test %d: %d events, %s" % (self.tests, len(events),
+                                                     "crashed" if reproduced else "passed"))
+        self.cache[key] = reproduced
+        return reproduced
+
+    def first_reproducing(self, executor, candidates):
+        """
+        index of the first candidate that reproduces the crash, or None
+        """
+        for start in range(0, len(candidates), self.workers):
+            wave = candidates[start:start + self.workers]
+            for index, reproduced in enumerate(executor.map(self.test, wave), start):
+                if reproduced:
+                    return index
+        return None
+
+    def minimize(self, events):
+        """
+        the minimal reproducing subsequence of events, None when events itself
+        does not reproduce the crash
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if not self.test(events):
+                return None
+            n = 2
+            while len(events) >= 2:
+                chunks = split(events, n)
+                candidates = list(chunks)
+                if n > 2:
+                    # for n == 2 the complements are the chunks themselves
+                    candidates += [[event_log for j, chunk in enumerate(chunks) if j != i for event_log in chunk]
+                                   for i in range(n)]
+                found = self.first_reproducing(executor, candidates)
+                if found is not None:
+                    n = 2 if found < len(chunks) else max(n - 1, 2)
+                    events = candidates[found]
+                    continue
+                if n >= len(events):
+                    break
+                n = min(n * 2, len(events))
+        return events
+
+
+def save_events(output_path, events):
+    """
+    the minimal sequence in the EventLog layout, so replay.py can run it
+    """
+    for event_log in events:
+        write_file(os.path.join(output_path, "events", "event_%s.json" % event_log["tag"]),
+                   json.dumps(event_log, indent=2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shrink the events of a crashing run to a minimal reproducing "
+                                                 "sequence, using every device in parallel.",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--device_serials", action="store", dest="device_serials", nargs="*", required=False,
+                        help="devices to replay on, default is every device listed by `adb devices`")
+    parser.add_argument("--apk_path", action="store", dest="apk_path", required=True)
+    parser.add_argument("--run_path", action="store", dest="run_path", required=True,
+                        help="output directory of the recorded run (events/ or trace.bin)")
+    parser.add_argument("--until", action="store", dest="until", required=False,
+                        help="tag of the crashing event, default is the event of the first recorded crash")
+    parser.add_argument("--throttle", action="store", dest="throttle", type=int, required=False, default=500,
+                        help="time gaps between two events")
+    parser.add_argument("--fast_forward", action="store_true", dest="fast_forward", required=False,
+                        help="replay without locating widgets, see replay.py")
+    parser.add_argument("--any_crash", action="store_true", dest="any_crash", required=False,
+                        help="accept any crash of the app, not only the recorded one")
+    parser.add_argument("--output_path", action="store", dest="output_path", required=False,
+                        help="where the minimal sequence goes, default is <run_path>/minimized")
+
+    options = parser.parse_args()
+    return options
+
+
+def main():
+    from adb import get_devices
+    from app import App
+    from device import DeviceUI
+
+    logging.basicConfig(level=logging.INFO)
+    opts = parse_args()
+    until = opts.until
+    if until is None:
+        crash_tags = load_crash_tags(opts.run_path)
+        until = crash_tags[0] if crash_tags else None
+    target = None if opts.any_crash or until is None else load_crash(opts.run_path, until)
+    events = load_events(opts.run_path, until)
+    output_path = opts.output_path or os.path.join(opts.run_path, "minimized")
+    device_serials = opts.device_serials or get_devices()
+    if not device_serials:
+        print("no devices found")
+        return
+
+    app = App(opts.apk_path)
+    replayers = []
+    for device_serial in device_serials:
+        device = DeviceUI(serial=device_serial, output_path=os.path.join(output_path, device_serial))
+        device.set_up()
+        device.connect()
+        device.install_app(app)
+        replayer = Replayer(device, app, throttle=opts.throttle, fast_forward=opts.fast_forward)
+        replayer.start()
+        replayers.append(replayer)
+
+    print("minimizing %d events on %d devices" % (len(events), len(replayers)))
+    start_time = time.time()
+    minimizer = Minimizer(replayers, target)
+    try:
+        minimal = minimizer.minimize(events)
+    finally:
+        for replayer in replayers:
+            replayer.stop()
+    if minimal is None:
+        print("the recorded events do not reproduce the crash")
+        return
+
+    save_events(output_path, minimal)
+    with open(os.path.join(output_path, "minimized.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "run_path":     opts.run_path,
+            "crash":        target,
+            "original":     len(events),
+            "minimal":      len(minimal),
+            "tests":        minimizer.tests,
+            "elapsed":      time.time() - start_time,
+            "tags":         [event_log["tag"] for event_log in minimal],
+        }, f, indent=2)
+    print("%d events -> %d events after %d replays, written to %s" % (len(events), len(minimal),
+                                                                      minimizer.tests, output_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,10 @@ from abc import abstractmethod
 
 from intent import Intent
 from event import Event, IntentEvent, KeyEvent
-from utils.tree.node import Node, ACTION_BACK_EVENT
-from utils.tree.trans_xml import xml_to_tree
+from utils.tree.node import ACTION_BACK_EVENT
 
 MODEL_RANDOM = "random"
+MODEL_COVERAGE = "coverage"
 
 
 class Model:
@@ -22,49 +22,61 @@ class Model:
     def start(self, controller):
         while controller.enabled:
             try:
-                event = self.generate_event()
-                controller.add_event(event)
+                state = controller.get_current_state()
+                if controller.batch_size > 1:
+                    controller.add_events(self.generate_events(state, controller.batch_size), state)
+                else:
+                    event = self.generate_event(state)
+                    controller.add_event(event, state)
                 self.get_coverage(controller)
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 self.logger.warning("exception during sending events: %s" % e)
+                controller.invalidate_state()
                 import traceback
                 traceback.print_exc()
                 continue
 
     @abstractmethod
-    def generate_event(self):
+    def generate_event(self, state):
         pass
 
+    def generate_events(self, state, size):
+        """
+        plan up to size events from one state. relaunching the app or going
+        back changes the screen, so the batch ends at the first such event
+        """
+        events = []
+        while len(events) < size:
+            event = self.generate_event(state)
+            events.append(event)
+            if event is None or isinstance(event, (IntentEvent, KeyEvent)):
+                break
+        return events
+
     def get_coverage(self, controller):
-        self.activities.add(controller.event_log.from_state.foreground_activity)
-        self.activities.add(controller.event_log.to_state.foreground_activity)
+        for state in (controller.event_log.from_state, controller.event_log.to_state):
+            # the launcher or another app in front is not coverage
+            if state.foreground_activity and state.foreground_activity.startswith(self.app.package_name):
+                self.activities.add(state.foreground_activity)
 
 
 class RandomModel(Model):
     def __init__(self, device, app):
         super(RandomModel, self).__init__(device, app)
 
-    def generate_event(self):
-        if not self.device.is_foreground(self.app):
+    def generate_event(self, state):
+        if state is None or not self.device.is_foreground(self.app, state):
             component = self.app.package_name
             if self.app.main_activity:
                 component += "/%s" % self.app.main_activity
             return IntentEvent(Intent(suffix=component))
 
-        trees = xml_to_tree(self.device.ui.dump_hierarchy())
-        tree = None
-        for temp_tree in trees:
-            package_name = temp_tree.package
-            if package_name == self.app.package_name:
-                tree = temp_tree
-        nodes = Node.get_nodes_from_tree(tree)
-        if len(nodes) == 0:
+        widgets = state.action_index.get_widgets(self.app.package_name)
+        if len(widgets) == 0:
             return KeyEvent(ACTION_BACK_EVENT)
-        node = self.select_node(nodes)
-
-        actions = node.get_actions_from_node(node)
+        node, actions = self.select_node(widgets)
         action_type = self.select_action(actions)
 
         return Event().from_action_type(node, action_type)
@@ -79,3 +91,50 @@ class RandomModel(Model):
         action_num = len(actions) - 1
         random_index = random.randint(0, action_num)
         return actions[random_index]
+
+
+class CoverageModel(RandomModel):
+    """
+    picks (widget, action) pairs of the current screen weighted by how rarely
+    they were tried on that screen: weight = 1 / (1 + visits) ** decay. the
+    screen is the state signature, a widget is its class, resource-id,
+    content-desc and text. going back is a candidate too, so it wins once
+    everything on the screen has been tried a few times.
+
+    the sampling uses random.choices over the candidate weights, a screen has
+    at most a few hundred candidates so this is cheaper than building arrays.
+    """
+    def __init__(self, device, app, decay=2):
+        super(CoverageModel, self).__init__(device, app)
+        self.decay = decay
+        # (signature, widget key, action) -> times chosen
+        self.visits = {}
+
+    def generate_event(self, state):
+        if state is None or not self.device.is_foreground(self.app, state):
+            return super(CoverageModel, self).generate_event(state)
+
+        widgets = state.action_index.get_widgets(self.app.package_name)
+        signature = state.signature
+        visits = self.visits
+        back_key = (signature, None, ACTION_BACK_EVENT)
+        candidates = [(None, ACTION_BACK_EVENT)]
+        keys = [back_key]
+        # going back counts as tried once, it should not compete with untried widgets
+        weights = [1.0 / (2 + visits.get(back_key, 0)) ** self.decay]
+        for node, actions in widgets:
+            widget_key = (node.class_, node.resource_id, node.content_desc, node.text)
+            # an untried widget weighs the same whatever its number of actions
+            share = 1.0 / len(actions)
+            for action in actions:
+                key = (signature, widget_key, action)
+                candidates.append((node, action))
+                keys.append(key)
+                weights.append(share / (1 + visits.get(key, 0)) ** self.decay)
+        index = random.choices(range(len(candidates)), weights=weights)[0]
+        visits[keys[index]] = visits.get(keys[index], 0) + 1
+
+        node, action_type = candidates[index]
+        if node is None:
+            return KeyEvent(ACTION_BACK_EVENT)
+        return Event().from_action_type(node, action_type)
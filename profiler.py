@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, the last bucket catches everything slower
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")]
+
+
+class Histogram:
+    """
+    streaming latency histogram with fixed buckets, constant memory per stage
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket the q-quantile falls in
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def histogram_dict(self):
+        return {
+            "count":    self.count,
+            "sum":      self.sum,
+            "mean":     self.sum / self.count if self.count else None,
+            "min":      self.min,
+            "max":      self.max,
+            "p50":      self.quantile(0.5),
+            "p90":      self.quantile(0.9),
+            "p99":      self.quantile(0.99),
+            "buckets":  {str(bound): count for bound, count in zip(HISTOGRAM_BUCKETS, self.buckets)},
+        }
+
+
+class StepProfiler:
+    """
+    per-stage latency histograms and an events/sec counter for the exploration
+    loop, periodically exported to metrics.json and metrics.prom (prometheus
+    text format) in the output path
+    """
+    def __init__(self, export_interval=30):
+        self.histograms = {}
+        self.events = 0
+        self.start_time = time.time()
+        self.output_path = None
+        self.export_interval = export_interval
+        self.last_export = time.time()
+        self.lock = threading.Lock()
+
+    def configure(self, output_path, export_interval=None):
+        self.output_path = output_path
+        if export_interval is not None:
+            self.export_interval = export_interval
+        self.start()
+
+    def start(self):
+        """
+        restart the events/sec clock, so uptime and the rate cover the
+        exploration loop and not the set up before it
+        """
+        with self.lock:
+            self.events = 0
+            self.start_time = time.time()
+            self.last_export = self.start_time
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count_events(self, count=1):
+        with self.lock:
+            self.events += count
+
+    @property
+    def events_per_second(self):
+        elapsed = time.time() - self.start_time
+        return self.events / elapsed if elapsed > 0 else 0
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "uptime":               time.time() - self.start_time,
+                "events":               self.events,
+                "events_per_second":    self.events_per_second,
+                "stages":               {name: histogram.histogram_dict
+                                         for name, histogram in sorted(self.histograms.items())},
+            }
+
+    def to_prometheus(self):
+        lines = ["# TYPE crashdect_events_total counter",
+                 "crashdect_events_total %d" % self.events,
+                 "# TYPE crashdect_events_per_second gauge",
+                 "crashdect_events_per_second %f" % self.events_per_second,
+                 "# TYPE crashdect_stage_seconds histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(HISTOGRAM_BUCKETS, histogram.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('crashdect_stage_seconds_bucket{stage="%s",le="%s"} %d' % (name, le, cumulative))
+                lines.append('crashdect_stage_seconds_sum{stage="%s"} %f' % (name, histogram.sum))
+                lines.append('crashdect_stage_seconds_count{stage="%s"} %d' % (name, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def export(self, output_path=None):
+        output_path = output_path or self.output_path
+        if output_path is None:
+            return
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path, exist_ok=True)
+        for file_name, content in (("metrics.json", json.dumps(self.to_dict(), indent=2)),
+                                   ("metrics.prom", self.to_prometheus())):
+            path = os.path.join(output_path, file_name)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        self.last_export = time.time()
+
+    def maybe_export(self):
+        if time.time() - self.last_export >= self.export_interval:
+            self.export()
+
+
+PROFILER = StepProfiler()
@@ -0,0 +1,331 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+from event import Event, IntentEvent, KeyEvent
+from event_trace import TraceReader, get_trace_paths
+from intent import Intent
+from utils.tree.node import Node, Point, ACTION_INTENT, ACTION_KEY_EVENT
+from utils.tree.trans_xml import BOUNDS_RE
+
+
+def load_events(run_path, until=None):
+    """
+    the recorded EventLog dicts of a run in order, read from the trace when the
+    run was recorded with --trace and from events/event_<tag>.json otherwise.
+    until is the tag of the crashing event (crash.tag), events after it are
+    dropped, except the rest of the batch it started.
+    """
+    trace_path, _ = get_trace_paths(run_path)
+    if os.path.exists(trace_path):
+        with TraceReader(run_path) as reader:
+            events = list(reader.events())
+    else:
+        events = []
+        for path in glob.glob(os.path.join(run_path, "events", "event_*.json")):
+            with open(path, encoding="utf-8") as f:
+                events.append(json.load(f))
+        events.sort(key=lambda event_log: int(event_log["tag"]))
+    if until is None:
+        return events
+    until = int(until)
+    return [event_log for event_log in events
+            if int(event_log["tag"]) <= until or (event_log.get("batch") or {}).get("id") == until]
+
+
+def load_crash_tags(run_path):
+    """
+    tags of the events the recorded crashes happened during, from crashes/crash_<tag>_<n>.json
+    """
+    tags = []
+    for path in sorted(glob.glob(os.path.join(run_path, "crashes", "crash_*.json"))):
+        with open(path, encoding="utf-8") as f:
+            tag = json.load(f).get("tag")
+        if tag is not None:
+            tags.append(tag)
+    return tags
+
+
+def load_crash(run_path, tag):
+    """
+    the recorded crash dict of the event with the given tag, None if there is none
+    """
+    for path in sorted(glob.glob(os.path.join(run_path, "crashes", "crash_%s_*.json" % tag))):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def is_same_crash(crash, target):
+    """
+    crash is a Crash, target a crash dict; the type and the exception line must match
+    """
+    return crash.crash_type == target.get("type") and crash.exception == target.get("exception")
+
+
+def node_from_event(event_dict):
+    """
+    a Node carrying the recorded widget, used when the widget is not on screen
+    anymore and the event is sent to the recorded bounds
+    """
+    node = Node()
+    node.text = event_dict.get("text") or ""
+    node.class_ = event_dict.get("class") or ""
+    node.resource_id = event_dict.get("resource_id") or ""
+    node.package = event_dict.get("package_name") or ""
+    node.content_desc = event_dict.get("content_desc") or ""
+    m = BOUNDS_RE.match(event_dict.get("bounds") or "")
+    if m:
+        node.bounds = Point(*m.groups())
+    return node
+
+
+def locate_node(widgets, event_dict):
+    """
+    find the recorded widget among the actionable widgets of the current
+    screen: resource-id, class and text must match (text is dropped on a
+    second try, it often holds counters or dates). several matches are
+    resolved by the distance to the recorded bounds. None when not found.
+    """
+    recorded = node_from_event(event_dict)
+    if not recorded.resource_id and not recorded.text and not recorded.content_desc:
+        # nothing identifies the widget but its position
+        return None
+    field_sets = [("resource_id", "class_", "text", "content_desc")]
+    if recorded.resource_id:
+        field_sets.append(("resource_id", "class_"))
+    for fields in field_sets:
+        candidates = [node for node, _ in widgets
+                      if all(getattr(node, field) == getattr(recorded, field) for field in fields)]
+        if candidates:
+            return min(candidates, key=lambda node: abs(node.bounds.x - recorded.bounds.x) +
+                                                    abs(node.bounds.y - recorded.bounds.y))
+    return None
+
+
+class ReplayResult:
+    def __init__(self):
+        self.crashes = []
+        # the target crash (any crash without a target) happened
+        self.reproduced = False
+        self.replayed = 0
+        self.located = 0
+        self.fallbacks = 0
+        self.final_state = None
+        self.elapsed = 0
+
+    @property
+    def crashed(self):
+        return len(self.crashes) > 0
+
+    @property
+    def result_dict(self):
+        return {
+            "crashed":      self.crashed,
+            "reproduced":   self.reproduced,
+            "replayed":     self.replayed,
+            "located":      self.located,
+            "fallbacks":    self.fallbacks,
+            "elapsed":      self.elapsed,
+            "final_state":  self.final_state.state_dict if self.final_state is not None else None,
+            "crashes":      [crash.crash_dict for crash in self.crashes],
+        }
+
+
+class Replayer:
+    """
+    re-executes recorded events on a device from a clean app start.
+
+    widgets are located again on the current screen by their recorded
+    resource-id/class/text, falling back to the recorded bounds. fast_forward
+    skips locating (no hierarchy dump per event), sends every event to its
+    recorded bounds with a minimal wait and captures the state only at the
+    end. a Replayer keeps one crash monitor and can replay many sequences.
+    """
+    def __init__(self, device, app, throttle=500, fast_forward=False, fast_throttle=50, clear_data=True,
+                 crash_wait=2):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.device = device
+        self.app = app
+        self.throttle = throttle
+        self.fast_forward = fast_forward
+        self.fast_throttle = fast_throttle
+        self.clear_data = clear_data
+        # seconds to wait after the last event for logcat to deliver a crash
+        self.crash_wait = crash_wait
+        self.crashes = []
+
+    def start(self):
+        self.device.logcat(self.app.package_name, self.on_crash)
+
+    def stop(self):
+        if self.device.crash_monitor is not None:
+            self.device.crash_monitor.stop()
+
+    def on_crash(self, crash):
+        self.crashes.append(crash)
+
+    def reset(self):
+        """
+        kill the app, optionally wipe its data, and launch it again
+        """
+        package_name = self.app.package_name
+        self.device.adb.shell_raw("am force-stop %s" % package_name)
+        if self.clear_data:
+            self.device.adb.shell_raw("pm clear %s" % package_name)
+        component = package_name
+        if self.app.main_activity:
+            component += "/%s" % self.app.main_activity
+        self.device.send_intent(Intent(suffix=component))
+        time.sleep(self.throttle / 1000)
+
+    def get_event(self, event_dict):
+        """
+        (event, located) for a recorded event dict
+        """
+        action = event_dict.get("action")
+        if action == ACTION_INTENT:
+            return IntentEvent(event_dict["intent"]), True
+        if action == ACTION_KEY_EVENT:
+            return KeyEvent(event_dict["key_event"]), True
+        node = None
+        if not self.fast_forward:
+            state = self.device.get_current_state()
+            if state is not None:
+                node = locate_node(state.action_index.get_widgets(event_dict.get("package_name")), event_dict)
+        located = node is not None
+        if node is None:
+            node = node_from_event(event_dict)
+        return Event().from_action_type(node, action), located
+
+    def drain(self):
+        """
+        wait until the crash monitor has flushed what logcat still holds from
+        the previous replay, at most twice its idle time
+        """
+        monitor = self.device.crash_monitor
+        if monitor is None:
+            return
+        deadline = time.time() + monitor.idle_time * 2
+        while (not monitor.lines.empty() or monitor.block is not None) and time.time() < deadline:
+            time.sleep(0.05)
+
+    def get_crashes(self, tags):
+        # a late crash of an earlier replay carries a tag of that replay (or None for a reset)
+        return [crash for crash in self.crashes if crash.tag in tags]
+
+    def is_reproduced(self, target, tags):
+        crashes = self.get_crashes(tags)
+        if target is None:
+            return len(crashes) > 0
+        return any(is_same_crash(crash, target) for crash in crashes)
+
+    def replay(self, events, stop_on_crash=True, target=None):
+        """
+        replay recorded EventLog dicts (see load_events), returns a ReplayResult.
+        target is the recorded crash dict to reproduce, other crashes (the app
+        is relaunched by a recorded intent, as in the run) do not stop the replay.
+        only crashes tagged with one of the replayed events count
+        """
+        result = ReplayResult()
+        start_time = time.time()
+        monitor = self.device.crash_monitor
+        if monitor is not None:
+            monitor.event_tag = None
+        self.reset()
+        self.drain()
+        self.crashes = []
+        tags = set(event_log["tag"] for event_log in events)
+        wait = (self.fast_throttle if self.fast_forward else self.throttle) / 1000
+        for event_log in events:
+            event, located = self.get_event(event_log["event"])
+            if event is None:
+                self.logger.warning("cannot replay event %s: %s" % (event_log["tag"], event_log["event"]))
+                continue
+            if monitor is not None:
+                monitor.event_tag = event_log["tag"]
+            self.device.send_event(event)
+            result.replayed += 1
+            if event_log["event"].get("action") not in (ACTION_INTENT, ACTION_KEY_EVENT):
+                if located:
+                    result.located += 1
+                else:
+                    result.fallbacks += 1
+            time.sleep(wait)
+            if stop_on_crash and self.is_reproduced(target, tags):
+                break
+
+        deadline = time.time() + self.crash_wait
+        while not self.is_reproduced(target, tags) and time.time() < deadline:
+            time.sleep(0.1)
+        result.crashes = self.get_crashes(tags)
+        result.reproduced = self.is_reproduced(target, tags)
+        result.final_state = self.device.get_current_state()
+        result.elapsed = time.time() - start_time
+        return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay the recorded events of a run to reproduce a crash.",
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--device_serial", action="store", dest="device_serial", required=True)
+    parser.add_argument("--apk_path", action="store", dest="apk_path", required=True)
+    parser.add_argument("--run_path", action="store", dest="run_path", required=True,
+                        help="output directory of the recorded run (events/ or trace.bin)")
+    parser.add_argument("--until", action="store", dest="until", required=False,
+                        help="tag of the last event to replay, default is the event of the first recorded crash")
+    parser.add_argument("--throttle", action="store", dest="throttle", type=int, required=False, default=500,
+                        help="time gaps between two events")
+    parser.add_argument("--fast_forward", action="store_true", dest="fast_forward", required=False,
+                        help="send events to their recorded bounds without locating the widgets,\n"
+                             "with minimal waits and no screenshots")
+    parser.add_argument("--keep_data", action="store_true", dest="keep_data", required=False,
+                        help="do not clear the app data before replaying")
+    parser.add_argument("--output_path", action="store", dest="output_path", required=False,
+                        help="where replay.json goes, default is <run_path>/replay")
+
+    options = parser.parse_args()
+    return options
+
+
+def main():
+    from app import App
+    from device import DeviceUI
+
+    opts = parse_args()
+    until = opts.until
+    if until is None:
+        crash_tags = load_crash_tags(opts.run_path)
+        until = crash_tags[0] if crash_tags else None
+    events = load_events(opts.run_path, until)
+    target = load_crash(opts.run_path, until) if until is not None else None
+    output_path = opts.output_path or os.path.join(opts.run_path, "replay")
+    print("replaying %d events until %s" % (len(events), until))
+
+    app = App(opts.apk_path)
+    device = DeviceUI(serial=opts.device_serial, output_path=output_path)
+    device.set_up()
+    device.connect()
+    device.install_app(app)
+    replayer = Replayer(device, app, throttle=opts.throttle, fast_forward=opts.fast_forward,
+                        clear_data=not opts.keep_data)
+    replayer.start()
+    try:
+        result = replayer.replay(events, target=target)
+    finally:
+        replayer.stop()
+
+    with open(os.path.join(output_path, "replay.json"), "w", encoding="utf-8") as f:
+        json.dump(result.result_dict, f, indent=2)
+    print("reproduced: %s, %d events in %.1fs (%d located, %d by bounds)" % (result.reproduced, result.replayed,
+                                                                           result.elapsed, result.located,
+                                                                           result.fallbacks))
+    for crash in result.crashes:
+        print("  %s during event %s: %s" % (crash.crash_type, crash.tag, crash.exception))
+
+
+if __name__ == '__main__':
+    main()
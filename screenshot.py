@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import PROFILER
+
+SCREENSHOT_NEVER = "never"
+SCREENSHOT_NEW_STATE = "new_state"
+SCREENSHOT_CRASH = "crash"
+SCREENSHOT_EVERY_N = "every_n"
+SCREENSHOT_POLICIES = [SCREENSHOT_NEVER, SCREENSHOT_NEW_STATE, SCREENSHOT_CRASH, SCREENSHOT_EVERY_N]
+
+
+class ScreenshotPolicy:
+    """
+    which states get a screenshot: never, the first visit of a state signature
+    only, only when the app crashed, or every n-th captured state
+    """
+    def __init__(self, policy=SCREENSHOT_EVERY_N, every=1):
+        assert policy in SCREENSHOT_POLICIES
+        self.policy = policy
+        self.every = max(1, every)
+
+    def should_capture(self, state_count, is_new_state):
+        if self.policy == SCREENSHOT_EVERY_N:
+            return state_count % self.every == 0
+        if self.policy == SCREENSHOT_NEW_STATE:
+            return is_new_state
+        return False
+
+    @property
+    def on_crash(self):
+        return self.policy != SCREENSHOT_NEVER
+
+
+class ScreenshotCapturer:
+    """
+    takes screenshots on a background thread so the exploration loop does not
+    wait for them, optionally downscaled (scale < 1) and saved as jpeg.
+    DeviceState.screenshot_path is set once the image is on disk.
+    """
+    def __init__(self, device, policy=None, scale=1.0, image_format="png", quality=80):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.device = device
+        self.policy = policy if policy is not None else ScreenshotPolicy()
+        self.scale = scale
+        self.image_format = image_format
+        self.quality = quality
+        self.state_count = 0
+        self.skipped = 0
+        # the last state capture submitted
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ScreenshotCapturer")
+
+    def on_state(self, state, is_new_state):
+        """
+        called once per captured state, before its event log is written,
+        schedules a screenshot if the policy wants one. while a capture is
+        still running the state is skipped (and marked screenshot_skipped), its
+        screenshot would only show a later screen and the queue would grow
+        faster than the device can serve it
+        """
+        if state is None or state.screenshot_checked:
+            return
+        state.screenshot_checked = True
+        self.state_count += 1
+        if self.policy.should_capture(self.state_count - 1, is_new_state):
+            if self.pending is not None and not self.pending.done():
+                state.screenshot_skipped = True
+                self.skipped += 1
+                self.logger.debug("capture still running, skipped the screenshot of state %s" % state.tag)
+                return
+            try:
+                self.pending = state.screenshot_future = self.executor.submit(self.capture_state, state)
+            except RuntimeError:
+                # already closed
+                pass
+
+    def on_crash(self, crash_output_path):
+        """
+        screenshot of whatever is on screen when a crash was reported, returns
+        the future of the capture (its result is None when the capture failed)
+        """
+        if not self.policy.on_crash:
+            return None
+        try:
+            return self.executor.submit(self.capture, crash_output_path)
+        except RuntimeError:
+            return None
+
+    def capture_state(self, state):
+        timestamp = int(time.time() * 1000)
+        local_image_dir = os.path.join(self.device.output_path, "temp")
+        path = os.path.join(local_image_dir, "%s_%s.%s" % (self.device.serial, timestamp, self.extension))
+        path = self.capture(path)
+        if path is not None:
+            state.screenshot_path = path
+            state.screenshot_time = timestamp
+        return path
+
+    @property
+    def extension(self):
+        return "jpg" if self.image_format == "jpeg" else "png"
+
+    def capture(self, path):
+        try:
+            dir_path = os.path.dirname(path)
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            with PROFILER.stage("take_screenshot"):
+                image = self.device.ui.screenshot()
+            if self.scale < 1:
+                image = image.resize((max(1, int(image.width * self.scale)),
+                                      max(1, int(image.height * self.scale))))
+            if self.image_format == "jpeg":
+                image.convert("RGB").save(path, format="JPEG", quality=self.quality)
+            else:
+                image.save(path, format="PNG")
+            return path
+        except Exception as e:
+            self.logger.warning("failed to take screenshot: %s" % e)
+            return None
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.skipped:
+            self.logger.info("skipped %d screenshots while a capture was running" % self.skipped)
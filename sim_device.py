@@ -0,0 +1,423 @@
+import glob
+import json
+import os
+import random
+import re
+import time
+
+from adb import ADB
+from app import App, get_activity_class
+from crash_monitor import CrashMonitor
+from device import DeviceUI
+from utils.tree.trans_xml import BOUNDS_RE, parse_hierarchy
+
+LAUNCHER_STATE = "launcher"
+LAUNCHER_ACTIVITY = "com.android.launcher/.Launcher"
+LAUNCHER_XML = "<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n" \
+               '<hierarchy rotation="0"><node index="0" text="" resource-id="" class="android.widget.FrameLayout" ' \
+               'package="com.android.launcher" content-desc="" checkable="false" checked="false" clickable="false" ' \
+               'enabled="true" focusable="false" focused="false" scrollable="false" long-clickable="false" ' \
+               'password="false" selected="false" visible-to-user="true" bounds="[0,0][1080,2340]" /></hierarchy>'
+
+# 1x1 png written for every simulated screenshot
+PNG_PIXEL = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+                          "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082")
+
+SELECTORS = ("resource_id", "class", "text", "content_desc")
+
+# seconds added to each simulated call, all zero by default
+DEFAULT_LATENCY = {
+    "dump_hierarchy":   0,
+    "click":            0,
+    "swipe":            0,
+    "press":            0,
+    "screenshot":       0,
+    "shell":            0,
+}
+
+
+def parse_bounds(bounds):
+    m = BOUNDS_RE.match(bounds or "")
+    return tuple(int(v) for v in m.groups()) if m else None
+
+
+def get_node_value(node, name):
+    return node.class_ if name == "class" else getattr(node, name)
+
+
+def in_bounds(bounds, x, y):
+    return bounds is not None and bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]
+
+
+class SimState:
+    def __init__(self, name, xml, activity):
+        self.name = name
+        self.xml = xml
+        self.activity = activity
+        self._trees = None
+
+    @property
+    def trees(self):
+        if self._trees is None:
+            self._trees = parse_hierarchy(self.xml)[0]
+        return self._trees
+
+    def find_nodes(self, x, y):
+        """
+        nodes whose bounds contain the point, a touch on a child also reaches
+        a clickable parent. children are not always inside their parent's
+        bounds, so the whole tree is searched
+        """
+        found = []
+        stack = list(self.trees)
+        while stack:
+            node = stack.pop()
+            b = node.bounds
+            if b.left_x <= x <= b.right_x and b.left_y <= y <= b.right_y:
+                found.append(node)
+            stack.extend(node.children)
+        return found
+
+
+class SimRecording:
+    """
+    hierarchies plus a transition table for the simulated device.
+
+    a recording file is json:
+        {"package_name": "...", "initial": "<state>",
+         "states": {"<state>": {"xml": "<file relative to the json>", "activity": "pkg/.Activity"}},
+         "transitions": [{"from": "<state>", "action": "click", "resource_id": "...", "to": "<state>"},
+                         {"from": "<state>", "key": "back", "to": "<state>"},
+                         {"from": "<state>", "action": "click", "bounds": "[0,0][10,10]", "crash": "<exception>"}]}
+    a transition matches on its action or key, then on the widgets under the
+    touch point (resource_id, class, text, content_desc) and the touch point
+    lying in its bounds, when given. "count" weights transitions that share a
+    trigger, a back key without a transition pops the screen history.
+    """
+    def __init__(self, package_name, states, transitions, initial, main_activity=None):
+        self.package_name = package_name
+        self.states = states
+        self.transitions = transitions
+        self.initial = initial
+        self.main_activity = main_activity
+        if LAUNCHER_STATE not in self.states:
+            self.states[LAUNCHER_STATE] = SimState(LAUNCHER_STATE, LAUNCHER_XML, LAUNCHER_ACTIVITY)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            recording = json.load(f)
+        base_path = os.path.dirname(os.path.abspath(path))
+        states = {}
+        for name, state in recording["states"].items():
+            with open(os.path.join(base_path, state["xml"]), encoding="utf-8") as f:
+                states[name] = SimState(name, f.read(), state["activity"])
+        return cls(recording["package_name"], states, recording.get("transitions", []), recording["initial"],
+                   recording.get("main_activity"))
+
+    @classmethod
+    def from_run(cls, output_path, package_name):
+        """
+        replay the screens and transitions of a real run's event logs
+        (events/event_<tag>.json and xmls/<xml_hash>.xml)
+        """
+        states = {}
+        transitions = []
+        initial = None
+        event_paths = sorted(glob.glob(os.path.join(output_path, "events", "event_*.json")),
+                             key=lambda path: int(re.search(r'event_(\d+)', path).group(1)))
+        for event_path in event_paths:
+            with open(event_path, encoding="utf-8") as f:
+                event_log = json.load(f)
+            names = []
+            for key in ("from_state", "to_state"):
+                state = event_log[key]
+                name = state["xml_hash"]
+                if name not in states:
+                    with open(os.path.join(output_path, "xmls", "%s.xml" % name), encoding="utf-8") as f:
+                        states[name] = SimState(name, f.read(), state["foreground_activity"])
+                names.append(name)
+            if initial is None:
+                # the first screen of the app, the run usually starts on the launcher
+                initial = next((name for name in names if states[name].activity and
+                                states[name].activity.startswith(package_name)), None)
+            transition = dict(event_log["event"])
+            transition.update({"from": names[0], "to": names[1]})
+            if "key_event" in transition:
+                transition["key"] = transition.pop("key_event")
+            transitions.append(transition)
+        return cls(package_name, states, transitions, initial)
+
+    @property
+    def activities(self):
+        return sorted(set(get_activity_class(state.activity) for state in self.states.values()
+                          if state.activity and state.activity.startswith(self.package_name)))
+
+    def get_app(self):
+        return SimApp(self.package_name, self.main_activity, self.activities)
+
+
+class SimApp(App):
+    """
+    App metadata taken from a recording instead of an apk
+    """
+    def __init__(self, package_name, main_activity, activities):
+        self.apk_path = None
+        self.cache_dir = None
+        self._apk = None
+        self.apk_hash = None
+        self.package_name = package_name
+        self.main_activity = main_activity
+        self.permissions = []
+        self.activities = activities
+
+
+class SimImage:
+    width = 1
+    height = 1
+
+    def resize(self, size):
+        return self
+
+    def convert(self, mode):
+        return self
+
+    def save(self, path, format=None, **kwargs):
+        with open(path, "wb") as f:
+            f.write(PNG_PIXEL)
+
+
+class SimUI:
+    """
+    the uiautomator2 calls the exploration loop makes
+    """
+    def __init__(self, device):
+        self.device = device
+        self.device_info = {
+            "udid": device.serial, "version": "11", "serial": device.serial, "brand": "sim", "model": "sim",
+            "hwaddr": "", "sdk": 30, "agentVersion": "sim",
+            "display": {"width": 1080, "height": 2340},
+            "battery": {"acPowered": True, "usbPowered": False, "status": 2, "health": 2, "present": True,
+                        "level": 100, "scale": 100, "voltage": 4200, "temperature": 250,
+                        "technology": "Li-ion"},
+            "memory": {"total": 4096, "around": "4 GB"},
+        }
+
+    def dump_hierarchy(self):
+        self.device.delay("dump_hierarchy")
+        return self.device.current.xml
+
+    def click(self, x, y):
+        self.device.delay("click")
+        self.device.touch("click", x, y)
+
+    def long_click(self, x, y):
+        self.device.delay("click")
+        self.device.touch("long_click", x, y)
+
+    def swipe_ext(self, direction, box=None):
+        self.device.delay("swipe")
+        x, y = ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2) if box else (540, 1170)
+        # swipe_ext names the finger movement, events name the scroll direction
+        action = {"up": "scroll_down_to_up", "down": "scroll_up_to_down",
+                  "left": "scroll_right_to_left", "right": "scroll_left_to_right"}[direction]
+        self.device.touch(action, x, y)
+
+    def press(self, name):
+        self.device.delay("press")
+        self.device.key(name)
+
+    def screenshot(self, filename=None):
+        self.device.delay("screenshot")
+        image = SimImage()
+        if filename:
+            image.save(filename)
+        return image
+
+    def app_start(self, package_name):
+        self.device.launch(None)
+
+    def stop(self):
+        pass
+
+
+class SimADB(ADB):
+    """
+    answers the shell commands the loop sends: the resumed activity query,
+    the idle probe, am start, input scripts, pm path, date
+    """
+    def __init__(self, device):
+        super(SimADB, self).__init__(device, use_socket=False)
+
+    def run_cmd(self, args):
+        if isinstance(args, str):
+            args = args.split()
+        if args and args[0] == "shell":
+            return self.shell_raw(" ".join(args[1:]))
+        return "Success"
+
+    def shell(self, args):
+        if isinstance(args, list):
+            args = " ".join(args)
+        return self.shell_raw(args)
+
+    def shell_raw(self, cmd):
+        self.device.delay("shell")
+        output = []
+        for line in cmd.split(";"):
+            output.append(self.device.run_shell_line(line.strip()))
+        return "\n".join(line for line in output if line)
+
+    def shell_stream(self, cmd):
+        return iter(self.shell_raw(cmd).splitlines())
+
+
+class SimDevice(DeviceUI):
+    """
+    a DeviceUI driven by a SimRecording instead of a real device, so the whole
+    exploration loop (Controller, Model, EventLog) runs on a plain linux box
+    """
+    def __init__(self, recording, serial="sim-0", output_path=None, latency=None, seed=0):
+        super(SimDevice, self).__init__(serial=serial, output_path=output_path)
+        self.recording = recording
+        self.adb = SimADB(self)
+        self.latency = dict(DEFAULT_LATENCY)
+        if latency:
+            self.latency.update(latency)
+        self.random = random.Random(seed)
+        self.current = recording.states[LAUNCHER_STATE]
+        self.history = []
+        self.installed = False
+        self.sent_events = 0
+
+    def delay(self, name):
+        seconds = self.latency.get(name, 0)
+        if seconds:
+            time.sleep(seconds)
+
+    def connect(self):
+        self.ui = SimUI(self)
+        self.device_info.get_attribute(self.ui.device_info)
+
+    def wait_for_device(self):
+        pass
+
+    def run_package_cmd(self, args):
+        self.installed = args[0] == "install"
+        return True, "Success"
+
+    def logcat(self, package_name=None, callback=None):
+        # simulated crashes are fed straight into the monitor, no logcat process
+        self.crash_monitor = CrashMonitor(self, package_name=package_name, callback=callback)
+        return self.crash_monitor
+
+    def go_to(self, name):
+        if name != self.current.name:
+            self.history.append(self.current.name)
+        self.current = self.recording.states[name]
+
+    def launch(self, component):
+        self.history = []
+        activity = get_activity_class(component)
+        for state in self.recording.states.values():
+            if activity and get_activity_class(state.activity) == activity:
+                self.go_to(state.name)
+                return
+        self.go_to(self.recording.initial)
+
+    def crash(self, exception):
+        if self.crash_monitor is not None:
+            prefix = "%s  4242  4242 E AndroidRuntime: " % time.strftime("%m-%d %H:%M:%S.000")
+            for line in ["FATAL EXCEPTION: main",
+                         "Process: %s, PID: 4242" % self.recording.package_name,
+                         exception,
+                         "\tat %s.Sim.crash(Sim.java:1)" % self.recording.package_name]:
+                self.crash_monitor.feed(prefix + line)
+            self.crash_monitor.flush()
+        self.history = []
+        self.current = self.recording.states[LAUNCHER_STATE]
+
+    def apply(self, transitions):
+        if not transitions:
+            return False
+        weights = [transition.get("count", 1) for transition in transitions]
+        transition = self.random.choices(transitions, weights=weights)[0]
+        if transition.get("crash"):
+            self.crash(transition["crash"])
+        else:
+            self.go_to(transition["to"])
+        return True
+
+    def touch(self, action, x, y):
+        self.sent_events += 1
+        nodes = self.current.find_nodes(x, y)
+        matched = []
+        for transition in self.recording.transitions:
+            if transition.get("from") != self.current.name or transition.get("action") != action:
+                continue
+            bounds = parse_bounds(transition.get("bounds"))
+            if bounds is not None and not in_bounds(bounds, x, y):
+                continue
+            selectors = [name for name in SELECTORS if transition.get(name)]
+            if not selectors or any(all(get_node_value(node, name) == transition[name] for name in selectors)
+                                    for node in nodes):
+                matched.append(transition)
+        self.apply(matched)
+
+    def key(self, name):
+        self.sent_events += 1
+        name = name.lower()
+        matched = [transition for transition in self.recording.transitions
+                   if transition.get("from") == self.current.name and transition.get("key") == name]
+        if self.apply(matched):
+            return
+        if name == "back":
+            self.current = self.recording.states[self.history.pop()] if self.history \
+                else self.recording.states[LAUNCHER_STATE]
+        elif name == "home":
+            self.history = []
+            self.current = self.recording.states[LAUNCHER_STATE]
+
+    def run_shell_line(self, line):
+        args = line.split()
+        if not args:
+            return ""
+        if line.startswith("dumpsys activity activities"):
+            return "  mResumedActivity: ActivityRecord{5150 u0 %s t1}" % self.current.activity
+        if line.startswith("dumpsys gfxinfo"):
+            # screens do not animate, the count only moves with the events
+            return "Total frames rendered: %d" % self.sent_events
+        if args[:2] == ["am", "start"]:
+            components = [arg for arg in args[2:] if "/" in arg and not arg.startswith("-")]
+            self.sent_events += 1
+            self.launch(components[0] if components else None)
+            return "Starting: Intent { cmp=%s }" % (components[0] if components else "")
+        if args[:2] == ["am", "force-stop"]:
+            self.history = []
+            self.current = self.recording.states[LAUNCHER_STATE]
+            return ""
+        if args[0] == "input" and len(args) > 1:
+            self.run_input(args[1:])
+            return ""
+        if args[:2] == ["pm", "path"]:
+            return "package:/data/app/%s/base.apk" % args[2] if self.installed else ""
+        if args[0] == "date":
+            return str(int(time.time()))
+        return ""
+
+    def run_input(self, args):
+        numbers = [int(float(arg)) for arg in args[1:] if re.match(r'^-?\d+(\.\d+)?$', arg)]
+        if args[0] == "tap" and len(numbers) >= 2:
+            self.touch("click", numbers[0], numbers[1])
+        elif args[0] == "swipe" and len(numbers) >= 4:
+            x1, y1, x2, y2 = numbers[:4]
+            if (x1, y1) == (x2, y2):
+                self.touch("long_click", x1, y1)
+                return
+            if abs(y2 - y1) >= abs(x2 - x1):
+                action = "scroll_down_to_up" if y2 < y1 else "scroll_up_to_down"
+            else:
+                action = "scroll_right_to_left" if x2 < x1 else "scroll_left_to_right"
+            self.touch(action, (x1 + x2) / 2, (y1 + y2) / 2)
+        elif args[0] == "keyevent" and len(args) > 1:
+            self.key(args[1].replace("KEYCODE_", ""))
@@ -3,8 +3,9 @@ import sys
 from threading import Timer
 
 from app import App
-from controller import Controller
-from device import DeviceUI
+from controller import Controller, SETTLE_FIXED
+from device import DeviceUI, INSTALL_STREAMING
+from screenshot import ScreenshotPolicy, SCREENSHOT_EVERY_N
 
 
 class SingleBot:
@@ -17,7 +18,18 @@ class SingleBot:
                  output_path,
                  keep_app,
                  model_name,
-                 grant_permission):
+                 grant_permission,
+                 trace=False,
+                 app=None,
+                 install_mode=INSTALL_STREAMING,
+                 settle_mode=SETTLE_FIXED,
+                 screenshot_policy=SCREENSHOT_EVERY_N,
+                 screenshot_every=1,
+                 screenshot_scale=1.0,
+                 screenshot_format="png",
+                 batch_size=1,
+                 metrics_interval=30,
+                 launch_activities=False):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.device_serial      = device_serial
         self.package_name       = package_name
@@ -28,31 +40,46 @@ class SingleBot:
         self.keep_app           = keep_app
         self.model_name         = model_name
         self.grant_permission   = grant_permission
+        self.trace              = trace
+        self.settle_mode        = settle_mode
+        self.screenshot_policy  = ScreenshotPolicy(screenshot_policy, screenshot_every)
         self.timer              = None
 
 
-        self.device     = DeviceUI(serial=device_serial, output_path=output_path, grant_permission=grant_permission)
-        self.app        = App(apk_path)
+        self.device     = DeviceUI(serial=device_serial, output_path=output_path, grant_permission=grant_permission,
+                                   install_mode=install_mode)
+        # a fleet parses the apk once and hands the same App to every bot
+        self.app        = app if app is not None else App(apk_path)
         if self.package_name == "":
             self.package_name = self.app.package_name
         self.controller = Controller(
-            device      = self.device,
-            app         = self.app,
-            model_name  = self.model_name,
-            throttle    = self.throttle
+            device            = self.device,
+            app               = self.app,
+            model_name        = self.model_name,
+            throttle          = self.throttle,
+            trace             = self.trace,
+            settle_mode       = self.settle_mode,
+            screenshot_policy = self.screenshot_policy,
+            screenshot_scale  = screenshot_scale,
+            screenshot_format = screenshot_format,
+            batch_size        = batch_size,
+            metrics_interval  = metrics_interval,
+            launch_activities = launch_activities
         )
 
     def start(self):
         try:
             if self.timeout > 0:
-                self.timer = Timer(self.timeout, self.stop)
+                self.timer = Timer(self.timeout, self.on_timeout)
                 self.timer.start()
 
             self.device.set_up()
             self.device.connect()
             self.device.install_app(self.app)
-            self.device.logcat()
+            self.device.logcat(self.app.package_name, self.controller.on_crash)
             self.controller.start()
+            self.stop()
+            return self.controller.get_summary()
         except KeyboardInterrupt:
             self.logger.info("Keyboard interrupt.")
         except Exception:
@@ -61,11 +88,17 @@ class SingleBot:
             self.stop()
             sys.exit(-1)
 
+    def on_timeout(self):
+        # runs on the timer thread, the loop notices and the main thread cleans up
+        self.controller.enabled = False
+
     def stop(self):
         if self.timer and self.timer.is_alive():
             self.timer.cancel()
         if not self.keep_app:
             self.device.uninstall_app(self.app)
+        if self.device.crash_monitor is not None:
+            self.device.crash_monitor.stop()
         if self.controller:
             self.controller.stop()
         # self.device.stop()
@@ -1,4 +1,5 @@
 import argparse
+import os
 from single_bot import SingleBot
 
 
@@ -10,32 +11,90 @@ def parse_args():
     parser.add_argument("--apk_path", action="store", dest="apk_path", required=True)
     parser.add_argument("--timeout", action="store", dest="timeout", required=False, default=60,
                         help="test time(minutes) default is 60 minutes")
-    parser.add_argument("--throttle", action="store", dest="throttle", required=False, default=500,
+    parser.add_argument("--throttle", action="store", dest="throttle", type=int, required=False, default=500,
                         help="time gaps between two events")
+    parser.add_argument("--settle_mode", action="store", dest="settle_mode", required=False, default="fixed",
+                        choices=["fixed", "adaptive"],
+                        help="fixed sleeps throttle ms after every event,\n"
+                             "adaptive waits until the hierarchy stops changing, at most throttle ms")
     parser.add_argument("--output_path", action="store", dest="output_path", required=False, default='./output/')
     parser.add_argument("--keep_app", action="store_true", dest="keep_app", required=False)
-    parser.add_argument("--model_name", action="store", dest="model_name", required=False, default='random')
+    parser.add_argument("--model_name", action="store", dest="model_name", required=False, default='random',
+                        choices=["random", "coverage"],
+                        help="random picks widgets uniformly,\n"
+                             "coverage favours actions not yet tried on the current screen")
     parser.add_argument("--grant_permission", action="store", dest="grant_permission", required=False, default=True)
+    parser.add_argument("--trace", action="store_true", dest="trace", required=False,
+                        help="store events in one compressed trace file instead of one file per event")
+    parser.add_argument("--install_mode", action="store", dest="install_mode", required=False, default="streaming",
+                        choices=["default", "streaming", "incremental"],
+                        help="adb install mode, incremental needs an apk with a v4 signature")
+    parser.add_argument("--screenshot_policy", action="store", dest="screenshot_policy", required=False,
+                        default="every_n", choices=["never", "new_state", "crash", "every_n"],
+                        help="which states get a screenshot, default is every_n")
+    parser.add_argument("--screenshot_every", action="store", dest="screenshot_every", type=int, required=False,
+                        default=1, help="n for the every_n screenshot policy")
+    parser.add_argument("--screenshot_scale", action="store", dest="screenshot_scale", type=float, required=False,
+                        default=1.0, help="downscale factor of the screenshots, e.g. 0.5")
+    parser.add_argument("--screenshot_format", action="store", dest="screenshot_format", required=False,
+                        default="png", choices=["png", "jpeg"])
+    parser.add_argument("--batch_size", action="store", dest="batch_size", type=int, required=False, default=1,
+                        help="events planned from one state and sent in one shell call, default is 1 (no batching)")
+    parser.add_argument("--metrics_interval", action="store", dest="metrics_interval", type=int, required=False,
+                        default=30, help="seconds between exports of metrics.json/metrics.prom to output_path")
+    parser.add_argument("--launch_activities", action="store_true", dest="launch_activities", required=False,
+                        help="start every activity of the manifest with am start before exploring the ui,\n"
+                             "launch crashes are listed in activity_launch.json")
+    parser.add_argument("--cprofile", action="store_true", dest="cprofile", required=False,
+                        help="run under cProfile and write crashdect.prof to output_path")
 
     options = parser.parse_args()
     return options
 
 
+def run_with_cprofile(func, output_path):
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    try:
+        profile.runcall(func)
+    finally:
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+        profile_path = os.path.join(output_path, "crashdect.prof")
+        profile.dump_stats(profile_path)
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(30)
+        print("cProfile stats written to", profile_path)
+
+
 def main():
     opts = parse_args()
 
     singleBot = SingleBot(
-        device_serial   = opts.device_serial,
-        package_name    = opts.package_name,
-        apk_path        = opts.apk_path,
-        timeout         = opts.timeout,
-        throttle        = opts.throttle,
-        output_path     = opts.output_path,
-        keep_app        = opts.keep_app,
-        model_name      = opts.model_name,
-        grant_permission= opts.grant_permission
+        device_serial     = opts.device_serial,
+        package_name      = opts.package_name,
+        apk_path          = opts.apk_path,
+        timeout           = opts.timeout,
+        throttle          = opts.throttle,
+        output_path       = opts.output_path,
+        keep_app          = opts.keep_app,
+        model_name        = opts.model_name,
+        grant_permission  = opts.grant_permission,
+        trace             = opts.trace,
+        install_mode      = opts.install_mode,
+        settle_mode       = opts.settle_mode,
+        screenshot_policy = opts.screenshot_policy,
+        screenshot_every  = opts.screenshot_every,
+        screenshot_scale  = opts.screenshot_scale,
+        screenshot_format = opts.screenshot_format,
+        batch_size        = opts.batch_size,
+        metrics_interval  = opts.metrics_interval,
+        launch_activities = opts.launch_activities
     )
-    singleBot.start()
+    if opts.cprofile:
+        run_with_cprofile(singleBot.start, opts.output_path)
+    else:
+        singleBot.start()
     return
 
 
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+
+
+def get_skeleton(node):
+    """
+    digest of a subtree's layout: class and resource-id of every node, text and
+    bounds are ignored and repeated children (list items) count once
+    """
+    children = sorted(set(get_skeleton(child) for child in node.children))
+    val = "%s|%s|%s" % (node.class_, node.resource_id, ",".join(children))
+    return hashlib.md5(val.encode("utf-8")).hexdigest()
+
+
+def get_state_signature(foreground_activity, trees):
+    """
+    structural signature of a screen: the foreground activity plus the layout
+    skeleton of the trees of the activity's package (all trees when unknown)
+    """
+    package_name = foreground_activity.split("/")[0] if foreground_activity else None
+    roots = [tree for tree in trees if tree.package == package_name] or trees
+    skeletons = [get_skeleton(tree) for tree in roots]
+    val = "%s|%s" % (foreground_activity, ",".join(skeletons))
+    return hashlib.md5(val.encode("utf-8")).hexdigest()
+
+
+def get_event_key(event_dict):
+    return json.dumps(event_dict, sort_keys=True)
+
+
+class StateNode:
+    def __init__(self, signature, foreground_activity, tag=None):
+        self.signature = signature
+        self.foreground_activity = foreground_activity
+        self.first_tag = tag
+        self.visits = 0
+
+    @property
+    def state_dict(self):
+        return {
+            "signature":            self.signature,
+            "foreground_activity":  self.foreground_activity,
+            "first_tag":            self.first_tag,
+            "visits":               self.visits
+        }
+
+
+class StateGraph:
+    """
+    screens seen during a run, keyed by state signature, with the transitions
+    between them labelled by the event that was sent
+    """
+    def __init__(self):
+        self.states = {}
+        # from signature -> {event key: {to signature: count}}
+        self.transitions = {}
+        self.events = {}
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, signature):
+        return signature in self.states
+
+    def add_state(self, state, tag=None):
+        """
+        count a visit of the state, returns True the first time it is seen
+        """
+        signature = state.signature
+        node = self.states.get(signature)
+        is_new = node is None
+        if is_new:
+            node = StateNode(signature, state.foreground_activity, tag)
+            self.states[signature] = node
+        node.visits += 1
+        return is_new
+
+    def add_transition(self, from_state, event, to_state, tag=None):
+        """
+        event may be a list, a batch sent in one go is a single transition
+        labelled by the event dicts of the whole batch
+        """
+        if from_state.signature not in self.states:
+            self.add_state(from_state, tag)
+        is_new = self.add_state(to_state, tag)
+
+        if isinstance(event, list):
+            event_dict = [e.event_dict for e in event]
+        else:
+            event_dict = event.event_dict
+        event_key = get_event_key(event_dict)
+        self.events[event_key] = event_dict
+        targets = self.transitions.setdefault(from_state.signature, {}).setdefault(event_key, {})
+        targets[to_state.signature] = targets.get(to_state.signature, 0) + 1
+        return is_new
+
+    def get_visits(self, signature):
+        node = self.states.get(signature)
+        return node.visits if node else 0
+
+    def get_transitions(self, signature):
+        """
+        {event key: {to signature: count}} of the transitions leaving a state
+        """
+        return self.transitions.get(signature, {})
+
+    def get_successors(self, signature):
+        successors = set()
+        for targets in self.get_transitions(signature).values():
+            successors.update(targets)
+        return successors
+
+    @property
+    def activities(self):
+        return set(node.foreground_activity for node in self.states.values())
+
+    def to_dict(self):
+        return {
+            "states":       [node.state_dict for node in self.states.values()],
+            "transitions":  [{"from": from_signature, "event": self.events[event_key], "to": to_signature,
+                              "count": count}
+                             for from_signature, edges in self.transitions.items()
+                             for event_key, targets in edges.items()
+                             for to_signature, count in targets.items()]
+        }
+
+    def save(self, output_path):
+        with open(os.path.join(output_path, "state_graph.json"), "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,318 @@
+import sys
+from array import array
+from itertools import compress
+from xml.parsers import expat
+
+from utils.tree.node import Point, ACTION_CLICK, ACTION_LONG_CLICK, ACTION_SCROLL_LEFT_TO_RIGHT, \
+    ACTION_SCROLL_RIGHT_TO_LEFT, ACTION_SCROLL_UP_TO_DOWN, ACTION_SCROLL_DOWN_TO_UP
+from utils.tree.trans_xml import BOUNDS_RE
+
+# boolean attributes, stored as bits of the flags column
+FLAG_ATTRIBUTES = ("checkable", "checked", "clickable", "enabled", "focusable", "focused",
+                   "scrollable", "long-clickable", "password", "selected", "visible-to-user")
+FLAGS = {name: 1 << i for i, name in enumerate(FLAG_ATTRIBUTES)}
+
+# the attributes actions are derived from, kept in their own byte column
+ACTION_CLICKABLE = 1
+ACTION_LONG_CLICKABLE = 2
+ACTION_SCROLLABLE = 4
+
+SCROLL_ACTIONS = [ACTION_SCROLL_LEFT_TO_RIGHT, ACTION_SCROLL_UP_TO_DOWN,
+                  ACTION_SCROLL_RIGHT_TO_LEFT, ACTION_SCROLL_DOWN_TO_UP]
+
+
+def get_actions_from_bits(bits):
+    # same precedence as Node.get_actions_from_node
+    if bits & ACTION_CLICKABLE:
+        return [ACTION_CLICK]
+    if bits & ACTION_LONG_CLICKABLE:
+        return [ACTION_LONG_CLICK]
+    if bits & ACTION_SCROLLABLE:
+        return list(SCROLL_ACTIONS)
+    return []
+
+
+# action bits -> actions, so a row's actions are one lookup
+ACTIONS_BY_BITS = [get_actions_from_bits(bits) for bits in range(8)]
+
+STRING_ATTRIBUTES = ("text", "resource-id", "class", "package", "content-desc")
+
+
+class CompactTree:
+    """
+    a whole hierarchy dump in flat columns: one row per node in document order,
+    int32 arrays for bounds and parent/child links, a bitmask column for the
+    boolean attributes, a byte column of action bits and interned string ids
+    for the text attributes. a subtree is a contiguous range of rows.
+    """
+    def __init__(self):
+        self.index = array("i")
+        self.left = array("i")
+        self.top = array("i")
+        self.right = array("i")
+        self.bottom = array("i")
+        self.flags = array("H")
+        self.action_bits = array("B")
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.string_ids = {name: array("i") for name in STRING_ATTRIBUTES}
+        self.strings = []
+        self.string_table = {}
+        self.roots = []
+
+    def __len__(self):
+        return len(self.flags)
+
+    def intern(self, value):
+        string_id = self.string_table.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(sys.intern(value))
+            self.string_table[value] = string_id
+        return string_id
+
+    def get_string(self, name, i):
+        return self.strings[self.string_ids[name][i]]
+
+    def add_node(self, attrib, parent):
+        i = len(self.flags)
+        self.index.append(int(attrib["index"]))
+        bounds = BOUNDS_RE.match(attrib["bounds"])
+        left, top, right, bottom = map(int, bounds.groups()) if bounds else (0, 0, 0, 0)
+        self.left.append(left)
+        self.top.append(top)
+        self.right.append(right)
+        self.bottom.append(bottom)
+
+        flags = 0
+        for name, bit in FLAGS.items():
+            if attrib[name] != "false":
+                flags |= bit
+        self.flags.append(flags)
+        self.action_bits.append((ACTION_CLICKABLE if flags & FLAGS["clickable"] else 0) |
+                                (ACTION_LONG_CLICKABLE if flags & FLAGS["long-clickable"] else 0) |
+                                (ACTION_SCROLLABLE if flags & FLAGS["scrollable"] else 0))
+        for name, column in self.string_ids.items():
+            column.append(self.intern(attrib[name]))
+
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        return i
+
+    def children(self, i):
+        child = self.first_child[i]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def node(self, i):
+        return NodeView(self, i)
+
+    @property
+    def trees(self):
+        """
+        root views, the same shape parse_hierarchy returns
+        """
+        return [NodeView(self, i) for i in self.roots]
+
+    def root_ranges(self):
+        return [(root, self.roots[n + 1] if n + 1 < len(self.roots) else len(self))
+                for n, root in enumerate(self.roots)]
+
+    def actionable(self, start=0, end=None):
+        """
+        rows of [start, end) with at least one action, selected over the
+        action bits column as a whole
+        """
+        end = len(self) if end is None else end
+        return list(compress(range(start, end), self.action_bits[start:end]))
+
+
+class CompactActionIndex:
+    """
+    ActionIndex over a CompactTree: the actionable widgets of a package are
+    selected column-wise from the row ranges of its trees when first asked for
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        self.widgets = {}
+
+    def get_widgets(self, package):
+        widgets = self.widgets.get(package)
+        if widgets is None:
+            tree = self.tree
+            package_id = tree.string_table.get(package)
+            package_column = tree.string_ids["package"]
+            rows = []
+            for start, end in tree.root_ranges():
+                if package_id is not None and package_column[start] == package_id:
+                    rows.extend(tree.actionable(start, end))
+            action_bits = tree.action_bits
+            widgets = [(NodeView(tree, i), list(ACTIONS_BY_BITS[action_bits[i]])) for i in rows]
+            self.widgets[package] = widgets
+        return widgets
+
+
+class NodeView:
+    """
+    read-only Node look-alike backed by a CompactTree row
+    """
+    __slots__ = ("tree", "i")
+
+    def __init__(self, tree, i):
+        self.tree = tree
+        self.i = i
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.tree is self.tree and other.i == self.i
+
+    def __hash__(self):
+        return hash((id(self.tree), self.i))
+
+    def flag(self, name):
+        return bool(self.tree.flags[self.i] & FLAGS[name])
+
+    @property
+    def index(self):
+        return self.tree.index[self.i]
+
+    @property
+    def text(self):
+        tree = self.tree
+        return tree.strings[tree.string_ids["text"][self.i]]
+
+    @property
+    def resource_id(self):
+        tree = self.tree
+        return tree.strings[tree.string_ids["resource-id"][self.i]]
+
+    @property
+    def class_(self):
+        tree = self.tree
+        return tree.strings[tree.string_ids["class"][self.i]]
+
+    @property
+    def package(self):
+        tree = self.tree
+        return tree.strings[tree.string_ids["package"][self.i]]
+
+    @property
+    def content_desc(self):
+        tree = self.tree
+        return tree.strings[tree.string_ids["content-desc"][self.i]]
+
+    @property
+    def checkable(self):
+        return self.flag("checkable")
+
+    @property
+    def checked(self):
+        return self.flag("checked")
+
+    @property
+    def clickable(self):
+        return self.flag("clickable")
+
+    @property
+    def enabled(self):
+        return self.flag("enabled")
+
+    @property
+    def focusable(self):
+        return self.flag("focusable")
+
+    @property
+    def focused(self):
+        return self.flag("focused")
+
+    @property
+    def scrollable(self):
+        return self.flag("scrollable")
+
+    @property
+    def long_clickable(self):
+        return self.flag("long-clickable")
+
+    @property
+    def password(self):
+        return self.flag("password")
+
+    @property
+    def selected(self):
+        return self.flag("selected")
+
+    @property
+    def visible_to_user(self):
+        return self.flag("visible-to-user")
+
+    @property
+    def bounds(self):
+        tree, i = self.tree, self.i
+        return Point(tree.left[i], tree.top[i], tree.right[i], tree.bottom[i])
+
+    @property
+    def children(self):
+        tree = self.tree
+        next_sibling = tree.next_sibling
+        children = []
+        child = tree.first_child[self.i]
+        while child != -1:
+            children.append(NodeView(tree, child))
+            child = next_sibling[child]
+        return children
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.i]
+        return NodeView(self.tree, parent) if parent != -1 else None
+
+    @property
+    def str(self):
+        return f'<index=%s text="%s" class="%s" resource-id="%s" package="%s" content-desc="%s" clickabele="%s">' % \
+               (self.index, self.text, self.class_, self.resource_id, self.package, self.content_desc, self.clickable)
+
+
+def xml_to_compact_tree(xml):
+    """
+    parse a uiautomator2 hierarchy dump into a CompactTree in one expat pass
+    """
+    tree = CompactTree()
+    stack = []
+    last_child = {}
+
+    def start_element(tag, attrib):
+        if tag != "node":
+            assert tag == "hierarchy" and not stack
+            return
+        parent = stack[-1] if stack else -1
+        i = tree.add_node(attrib, parent)
+        if parent == -1:
+            tree.roots.append(i)
+        else:
+            previous = last_child.get(parent)
+            if previous is None:
+                tree.first_child[parent] = i
+            else:
+                tree.next_sibling[previous] = i
+            last_child[parent] = i
+        stack.append(i)
+
+    def end_element(tag):
+        if tag == "node":
+            last_child.pop(stack.pop(), None)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.Parse(xml, True)
+    return tree
+
+
+def parse_compact_hierarchy(xml):
+    """
+    parse_hierarchy backed by a CompactTree: (root views, CompactActionIndex)
+    """
+    tree = xml_to_compact_tree(xml)
+    return tree.trees, CompactActionIndex(tree)
@@ -82,7 +82,7 @@ class Node:
         class_ = node.class_
         clickable = node.clickable
         long_clickable = node.long_clickable
-        scrollable = node.long_clickable
+        scrollable = node.scrollable
 
         # if class_ == EDIT_CLASS:
         #     actions.append(ACTION_EDIT)
@@ -96,3 +96,18 @@ class Node:
             actions.append(ACTION_SCROLL_RIGHT_TO_LEFT)
             actions.append(ACTION_SCROLL_DOWN_TO_UP)
         return actions
+
+
+class ActionIndex:
+    """
+    actionable widgets of a hierarchy with their actions, grouped by the
+    package of the tree they belong to, filled in while parsing
+    """
+    def __init__(self):
+        self.widgets = {}
+
+    def add(self, package, node, actions):
+        self.widgets.setdefault(package, []).append((node, actions))
+
+    def get_widgets(self, package):
+        return self.widgets.get(package, [])
@@ -1,7 +1,8 @@
 import re
-import xml.etree.ElementTree as ET
-import collections
-from utils.tree.node import Node, Point
+from xml.parsers import expat
+from utils.tree.node import Node, Point, ActionIndex
+
+BOUNDS_RE = re.compile(r'\[([^ ]+),([^ ]+)\]\[([^ ]+),([^ ]+)\]')
 
 
 def element_to_node(attr):
@@ -12,82 +13,77 @@ def element_to_node(attr):
     node.class_             = attr['class']
     node.package            = attr['package']
     node.content_desc       = attr['content-desc']
-    node.checkable          = False if attr['checkable'] == "false" else True
-    node.checked            = False if attr['checked'] == "false" else True
-    node.clickable          = False if attr['clickable'] == "false" else True
-    node.enabled            = False if attr['enabled'] == "false" else True
-    node.focusable          = False if attr['focusable'] == "false" else True
-    node.focused            = False if attr['focused'] == "false" else True
-    node.scrollable         = False if attr['scrollable'] == "false" else True
-    node.long_clickable     = False if attr['long-clickable'] == "false" else True
-    node.password           = False if attr['password'] == "false" else True
-    node.selected           = False if attr['selected'] == "false" else True
-    node.visible_to_user    = False if attr['visible-to-user'] == "false" else True
-    bounds                  = attr['bounds']
-
-    source_bounds = re.compile('\[([^ ]+),([^ ]+)\]\[([^ ]+),([^ ]+)\]')
-    dist_activities = source_bounds.search(bounds)
-    if dist_activities:
-        node.bounds = Point(dist_activities.group(1),
-                            dist_activities.group(2),
-                            dist_activities.group(3),
-                            dist_activities.group(4))
+    node.checkable          = attr['checkable'] != "false"
+    node.checked            = attr['checked'] != "false"
+    node.clickable          = attr['clickable'] != "false"
+    node.enabled            = attr['enabled'] != "false"
+    node.focusable          = attr['focusable'] != "false"
+    node.focused            = attr['focused'] != "false"
+    node.scrollable         = attr['scrollable'] != "false"
+    node.long_clickable     = attr['long-clickable'] != "false"
+    node.password           = attr['password'] != "false"
+    node.selected           = attr['selected'] != "false"
+    node.visible_to_user    = attr['visible-to-user'] != "false"
+
+    bounds = BOUNDS_RE.match(attr['bounds'])
+    if bounds:
+        node.bounds = Point(*bounds.groups())
     return node
 
 
-def hash_tag_attrib(attrib):
-    val = attrib['index'] + attrib['text'] + attrib['resource-id'] + attrib['class'] + attrib['package'] + attrib['content-desc'] + attrib['bounds']
-    return hash(val)
-
-
 def get_root_tree(element):
-    element_node_table = {}
-    q = collections.deque()
-    q.append(element)
-
+    """
+    build the Node tree of an ElementTree element, parents are tracked on a stack
+    """
     root = element_to_node(element.attrib)
-    hash_attrib = hash_tag_attrib(element.attrib)
-    element_node_table[hash_attrib] = root
-
-    while q:
-        el = q.pop()
-
-        attrib = el.attrib
-        hash_attrib = hash_tag_attrib(attrib)
-        if hash_attrib not in element_node_table.keys():
-            element_node_table[hash_attrib] = element_to_node(attrib)
-        temp_root_node = element_node_table[hash_attrib]
-
+    stack = [(element, root)]
+    while stack:
+        el, parent = stack.pop()
         for child in el:
-            q.append(child)
-
             child_node = element_to_node(child.attrib)
-            temp_root_node.children.append(child_node)
-            child_node.parent = temp_root_node
-
-            hash_attrib = hash_tag_attrib(child.attrib)
-            element_node_table[hash_attrib] = child_node
-
+            child_node.parent = parent
+            parent.children.append(child_node)
+            stack.append((child, child_node))
     return root
 
 
 def xml_to_tree(xml):
-    elements = []
-
-    root_et = ET.fromstring(xml)
-    q = collections.deque()
-    q.append(root_et)
+    return parse_hierarchy(xml)[0]
 
-    # 过滤 hierarchy, 得到n个element
-    el = q.pop()
-    assert el.tag == "hierarchy"
-    for child in el:
-        elements.append(child)
 
-    # 遍历n个element，获取对应n个树
+def parse_hierarchy(xml):
+    """
+    parse a uiautomator2 hierarchy dump into one Node tree per top level node,
+    in a single expat pass without building an intermediate ElementTree.
+    returns (roots, ActionIndex of the actionable nodes)
+    """
     roots = []
-    for el in elements:
-        root = get_root_tree(el)
-        roots.append(root)
-
-    return roots
+    stack = []
+    action_index = ActionIndex()
+
+    def start_element(tag, attrib):
+        if tag != "node":
+            assert tag == "hierarchy" and not stack
+            return
+        node = element_to_node(attrib)
+        if stack:
+            parent = stack[-1]
+            node.parent = parent
+            parent.children.append(node)
+        else:
+            roots.append(node)
+        stack.append(node)
+
+        actions = Node.get_actions_from_node(node)
+        if actions:
+            action_index.add(stack[0].package, node, actions)
+
+    def end_element(tag):
+        if tag == "node":
+            stack.pop()
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.Parse(xml, True)
+    return roots, action_index